@@ -1,14 +1,20 @@
 import streamlit as st
-from fastai.vision.all import *
 import pathlib
-import pandas as pd
-from PIL import Image
 import platform
 import streamlit as st
-import urllib.request
-import json
 import os
 import ssl
+from catalog import get_catalog
+from inference import fuse_results, top_k
+from inference_server import get_server, ServerBusy
+from face_regions import predict_regions, predict_regions_many
+from llm_client import get_response, stream_response, STREAM
+from llm_cache import cached_response, cached_stream_response
+from relevance import is_psychology_related
+from prompts import build_prompt
+import telemetry
+import warmup
+from telemetry import span
 
 # Handle different OS paths
 plt = platform.system()
@@ -17,6 +23,15 @@ if plt == 'Linux': pathlib.WindowsPath = pathlib.PosixPath
 # Set page configuration
 st.set_page_config(page_title="SFIE Beauty Sandbox")
 
+# Per-stage timings (no-ops unless SFIE_TELEMETRY or SFIE_DEBUG_PANEL is set)
+telemetry.start()
+telemetry.begin_rerun()
+
+# Load the model and catalog and run dummy batches in the background once per process;
+# GET /ready on SFIE_READY_PORT answers 503 until that is done. Behind a load balancer, start
+# with serve.py, which runs this before the first session; here it is then a no-op.
+warmup.start()
+
 st.markdown(
         """
         <style>
@@ -61,43 +76,58 @@ if st.session_state.app_mode == "Home":
     st.write(description)
     st.write("Kindly upload a photo of your face.")
 
-    # Load the model
-    learn = load_learner('export.pkl')
-    labels = learn.dls.vocab
+    # Load the model (in the inference worker processes with SFIE_INFERENCE_WORKERS and the direct backend)
+    with span("model_load"):
+        get_server('export.pkl').backend.version()
 
     # Load the recommendation data
-    df = pd.read_excel("recommendation.xlsx")
-    classes = df['class'].unique()
+    with span("catalog"):
+        catalog = get_catalog("recommendation.xlsx")
+    classes = catalog.classes
 
 
     # Define the prediction function
     def predict(img):
-        img = PILImage.create(img)  # Convert to FastAI's PILImage type
-        pred, pred_idx, probs = learn.predict(img)
-        return {labels[i]: float(probs[i]) for i in range(len(labels))}
+        # Queued on the shared inference worker, which batches concurrent sessions together.
+        # With SFIE_FACE_CROP set, the face (or its skin zones) is cropped out first.
+        with span("predict"):
+            return predict_regions(get_server('export.pkl'), img).result
 
 
-    # Image upload
+    # Image upload (PIL, like the rest of the vision stack, is only imported by the analyzer pages)
+    from ingest import ingest_upload, UploadRejected
     uploaded_file = st.file_uploader("Choose a face image...", type=["jpg", "jpeg", "png"])
 
+    # Decode once at reduced size: a display thumbnail plus a model-sized image
+    upload = None
     if uploaded_file is not None:
-        img = Image.open(uploaded_file)
-        st.image(img, caption="Uploaded Image", use_column_width=True)
+        try:
+            with span("decode"):
+                upload = ingest_upload(uploaded_file)
+        except UploadRejected as e:
+            st.error(str(e))
+
+    if upload is not None:
+        img = upload.model_image
+        st.image(upload.thumbnail, caption="Uploaded Image", use_column_width=True)
 
         if st.button("Predict"):
-            results = predict(img)
-            st.write("Prediction Results:")
-            top_3 = sorted(results.items(), key=lambda x: x[1], reverse=True)[:3]
-            st.write("Top 3 Conditions:")
-            for label, prob in top_3:
-                st.write(f"{label}: {prob:.2%}")
-                st.progress(int(prob * 100))
+            try:
+                results = predict(img)
+            except ServerBusy:
+                st.error("The analyzer is busy, please try again in a moment.")
+            else:
+                st.write("Prediction Results:")
+                top_3 = sorted(results.items(), key=lambda x: x[1], reverse=True)[:3]
+                st.write("Top 3 Conditions:")
+                for label, prob in top_3:
+                    st.write(f"{label}: {prob:.2%}")
+                    st.progress(int(prob * 100))
 
         st.write("### Find your skin condition using the analyzer above and see recommended solutions:")
         for c in classes:
             with st.expander(c):
-                df_temp = df[df['class'] == c]
-                for _, row in df_temp.iterrows():
+                for row in catalog.for_class(c):
                     st.markdown(
                         f"<a href='{row['profit_link']}' target='_blank'><img src='{row['product_image']}' style='width:150px;'></a>",
                         unsafe_allow_html=True
@@ -152,56 +182,18 @@ else:
             elif not is_psychology_related(prompt):
                 st.error("Irrelevant prompt.")
             else:
-                with st.spinner('Processing...'):
-                    response = get_response(prompt, api_key)
-                    st.success("Done!")
+                if STREAM:
                     st.write("Response:")
-                    st.write(response)
-
-
-    # Function to check if the prompt is psychology-related
-    def is_psychology_related(prompt):
-        psychology_keywords = [
-            'skincare', 'skin health', 'skin type', 'skincare routine', 'skincare products', 'moisturizer',
-            'cleanser', 'toner', 'serum', 'sunscreen', 'exfoliation', 'hydration', 'acne treatment',
-            'anti-aging', 'hyperpigmentation', 'sensitive skin', 'dry skin', 'oily skin', 'combination skin',
-            'skin barrier', 'collagen', 'retinol', 'vitamin C', 'hyaluronic acid', 'niacinamide',
-            'peptides', 'AHAs', 'BHAs', 'natural skincare', 'dermatologist', 'facial', 'skin concerns',
-            'dark spots', 'redness', 'blemishes', 'eczema', 'psoriasis', 'rosacea', 'dermatitis',
-            'pore size', 'skin texture', 'skin tone', 'under-eye care', 'skin detox', 'allergic reactions'
-        ]
-        return any(keyword.lower() in prompt.lower() for keyword in psychology_keywords)
-
-
-    # Function to get response from Azure-based LLM
-    def get_response(prompt, api_key):
-        data = {
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "max_tokens": 1024,
-            "temperature": 0.7,
-            "top_p": 1,
-            "stream": False
-        }
-
-        body = str.encode(json.dumps(data))
-
-        url = ''
-        headers = {'Content-Type': 'application/json', 'Authorization': ('Bearer ' + api_key)}
-
-        req = urllib.request.Request(url, body, headers)
-
-        try:
-            response = urllib.request.urlopen(req)
-            result = response.read()
-            result_json = json.loads(result)
-            return result_json['choices'][0]['message']['content']
-        except urllib.error.HTTPError as error:
-            return f"The request failed with status code: {error.code}\n{error.read().decode('utf8', 'ignore')}"
+                    with span("llm"):
+                        st.write_stream(stream_response(prompt, api_key))
+                    st.success("Done!")
+                else:
+                    with st.spinner('Processing...'):
+                        with span("llm"):
+                            response = get_response(prompt, api_key)
+                        st.success("Done!")
+                        st.write("Response:")
+                        st.write(response)
 
 
     # Personalized Beauty Care app
@@ -416,51 +408,88 @@ else:
         st.write(description)
         st.write("Kindly upload a photo of your face.")
 
-        # Load the model
-        learn = load_learner('export.pkl')
-        labels = learn.dls.vocab
+        # Load the model (in the inference worker processes with SFIE_INFERENCE_WORKERS and the direct backend)
+        with span("model_load"):
+            get_server('export.pkl').backend.version()
 
         # Load the recommendation data
-        df = pd.read_excel("recommendation.xlsx")
-        classes = df['class'].unique()
+        with span("catalog"):
+            catalog = get_catalog("recommendation.xlsx")
+        classes = catalog.classes
 
         # Define the prediction function
         def predict(img):
-            img = PILImage.create(img)  # Convert to FastAI's PILImage type
-            pred, pred_idx, probs = learn.predict(img)
-            return {labels[i]: float(probs[i]) for i in range(len(labels))}
+            # Queued on the shared inference worker, which batches concurrent sessions together.
+            # With SFIE_FACE_CROP set, the face (or its skin zones) is cropped out first.
+            with span("predict"):
+                return predict_regions(get_server('export.pkl'), img).result
 
         # Image upload
+        from ingest import ingest_upload, UploadRejected
         uploaded_files = st.file_uploader("Choose images...", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
 
         if uploaded_files:
             # Create columns based on the number of uploaded files
             cols = st.columns(len(uploaded_files))
+            imgs = []
+            img_cols = []
 
             for col, uploaded_file in zip(cols, uploaded_files):
-                img = Image.open(uploaded_file)
+                try:
+                    with span("decode"):
+                        upload = ingest_upload(uploaded_file)
+                except UploadRejected as e:
+                    with col:
+                        st.error(str(e))
+                    continue
 
                 # Resize image to a standard size (e.g., 256x256)
-                img = img.resize((256, 256))
+                img = upload.model_image.resize((256, 256))
+                imgs.append(img)
+                img_cols.append(col)
 
                 # Display the uploaded image in the corresponding column
                 with col:
                     st.image(img, caption=uploaded_file.name, use_column_width=False)  # Use False for fixed width
 
                     if st.button(f"Predict for {uploaded_file.name}", key=uploaded_file.name):
-                        results = predict(img)
-                        st.write("Prediction Results:")
-                        top_3 = sorted(results.items(), key=lambda x: x[1], reverse=True)[:3]
-                        st.write("Top 3 Conditions:")
-                        for label, prob in top_3:
-                            st.write(f"{label}: {prob:.2%}")
-                            st.progress(int(prob * 100))
+                        try:
+                            results = predict(img)
+                        except ServerBusy:
+                            st.error("The analyzer is busy, please try again in a moment.")
+                        else:
+                            st.write("Prediction Results:")
+                            top_3 = sorted(results.items(), key=lambda x: x[1], reverse=True)[:3]
+                            st.write("Top 3 Conditions:")
+                            for label, prob in top_3:
+                                st.write(f"{label}: {prob:.2%}")
+                                st.progress(int(prob * 100))
+
+            # Score every photo in a single forward pass
+            if imgs and st.button("Analyze all"):
+                try:
+                    with span("predict"):
+                        all_results = [r.result for r in predict_regions_many(get_server('export.pkl'), imgs)]
+                except ServerBusy:
+                    st.error("The analyzer is busy, please try again in a moment.")
+                else:
+                    for col, results in zip(img_cols, all_results):
+                        with col:
+                            st.write("Top 3 Conditions:")
+                            for label, prob in top_k(results):
+                                st.write(f"{label}: {prob:.2%}")
+                                st.progress(int(prob * 100))
+
+                    st.write("Combined result across all photos:")
+                    for label, prob in top_k(fuse_results(all_results)):
+                        st.write(f"{label}: {prob:.2%}")
+                        st.progress(int(prob * 100))
 
             # st.write("### Find your skin condition using the analyzer above and see recommended solutions:")
             for c in classes:
                 with st.expander(c):
-                    df_temp = df[df['class'] == c]
-                    # for _, row in df_temp.iterrows():
+                    products = catalog.for_class(c)
+                    # for row in products:
                     #     st.markdown(
                     #         f"<a href='{row['profit_link']}' target='_blank'><img src='{row['product_image']}' style='width:150px;'></a>",
                     #         unsafe_allow_html=True
@@ -492,26 +521,22 @@ else:
         }
 
         # Generate the prompt
-        prompt = f"""
-        Based on the answers provided from the questionnaire, could you provide skincare product recommendations, 
-        treatment alternatives, and a skincare diagnosis and routine planner for 1 month? Here are the details:
-        - Skin goals: {answers['skin_goals']}
-        - Skin type: {answers['skin_type']}
-        - Reaction frequency: {answers['reaction_frequency']}
-        - Skin tone: {answers['skin_tone']}
-        - Recent skin symptoms: {answers['skin_symptoms']}
-        - Skin conditions: {answers['skin_conditions']}
-        - Date of birth: {answers['birthday']}
-        """
+        prompt = build_prompt(answers)
 
         # Assume API key is already stored in the session
         api_key = st.text_input("Enter your API key:", type="password")
 
         if api_key:
-            with st.spinner("Getting your skincare recommendations..."):
-                response = get_response(prompt, api_key)
+            if STREAM:
                 st.success("Here are your personalized skincare recommendations!")
-                st.write(response)
+                with span("llm"):
+                    st.write_stream(cached_stream_response(answers, prompt, api_key))
+            else:
+                with st.spinner("Getting your skincare recommendations..."):
+                    with span("llm"):
+                        response = cached_response(answers, prompt, api_key)
+                    st.success("Here are your personalized skincare recommendations!")
+                    st.write(response)
         else:
             st.error("API key missing. Please provide your API key in the SFIE Beauty LLM section.")
 
@@ -521,3 +546,16 @@ else:
         sfie_beauty_llm()
     else:
         personalized_beauty_care()
+
+
+# Stage breakdown of this rerun, rendered last so every span above is included
+if telemetry.DEBUG_PANEL:
+    spans, elapsed = telemetry.rerun_breakdown()
+    with st.sidebar.expander("Debug: stage timings", expanded=True):
+        for stage, seconds in spans:
+            st.write(f"{stage}: {seconds * 1000:.1f} ms")
+        if elapsed is not None:
+            st.write(f"Script run so far: {elapsed * 1000:.1f} ms")
+        st.write(telemetry.stage_metrics())
+    with st.sidebar.expander("Debug: component metrics"):
+        st.write(telemetry.component_metrics())
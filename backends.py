@@ -0,0 +1,313 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+import preprocess
+from inference import predict_batch
+from metrics import percentile
+from model_registry import get_learner, get_model, model_version
+
+logger = logging.getLogger(__name__)
+
+# Which runtime serves predict(): fastai, direct, torchscript, torchscript-int8, onnx or onnx-int8
+BACKEND = os.environ.get('SFIE_MODEL_BACKEND', 'fastai')
+EXPORT_DIR = os.environ.get('SFIE_EXPORT_DIR', 'export')
+
+# Files written by export_model.py into EXPORT_DIR
+ARTIFACTS = {
+    'torchscript': 'model.pt',
+    'torchscript-int8': 'model.int8.pt',
+    'onnx': 'model.onnx',
+    'onnx-int8': 'model.int8.onnx',
+}
+SPEC_FILE = 'preprocess.json'
+
+# Two-tier cascade: when SFIE_CASCADE_FAST names a backend, it answers first and only photos it is
+# unsure about (top-1 below MIN_CONFIDENCE or top-1/top-2 margin below MIN_MARGIN) go to BACKEND.
+# SFIE_CASCADE_FAST_SIZE runs the 'direct' fast tier at a reduced input size (0: the model's own).
+CASCADE_FAST = os.environ.get('SFIE_CASCADE_FAST', '')
+CASCADE_FAST_SIZE = int(os.environ.get('SFIE_CASCADE_FAST_SIZE', 160))
+CASCADE_MIN_CONFIDENCE = float(os.environ.get('SFIE_CASCADE_MIN_CONFIDENCE', 0.8))
+CASCADE_MIN_MARGIN = float(os.environ.get('SFIE_CASCADE_MIN_MARGIN', 0.3))
+
+
+def _load_torchscript(path):
+    import torch
+    return torch.jit.load(path, map_location='cpu').eval()
+
+
+def _load_onnx(path):
+    import onnxruntime
+    return onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+
+
+def to_results(vocab, probs):
+    return [{vocab[i]: float(row[i]) for i in range(len(vocab))} for row in probs]
+
+
+class FastaiBackend:
+    name = 'fastai'
+
+    def __init__(self, model_path='export.pkl'):
+        self.model_path = model_path
+
+    # Identifies the weights and runtime, so cached predictions never outlive a model swap
+    def version(self):
+        return f"{self.name}:{model_version(self.model_path)}"
+
+    # Class names the model predicts
+    def vocab(self):
+        return [str(v) for v in get_learner(self.model_path).dls.vocab]
+
+    def predict_batch(self, imgs):
+        return predict_batch(get_learner(self.model_path), imgs)
+
+
+# Same pipeline with the final input side scaled down to `size` (the CNN's pooling head accepts any size)
+def scaled_spec(spec, size):
+    spec = dict(spec)
+    scale = size / max(spec["crop"] or spec["resize"]["size"])
+    if spec["resize"] is not None:
+        spec["resize"] = dict(spec["resize"], size=[round(v * scale) for v in spec["resize"]["size"]])
+    if spec["crop"] is not None:
+        spec["crop"] = [round(v * scale) for v in spec["crop"]]
+    return spec
+
+
+# The Learner's own model fed by preprocess.py's vectorized batch pipeline instead of fastai's per-item one
+class DirectBackend:
+    def __init__(self, model_path='export.pkl', size=None):
+        self.model_path = model_path
+        self.size = size
+        self.name = f'direct@{size}' if size else 'direct'
+        self._spec = None
+        self._spec_learner = None
+
+    def version(self):
+        return f"{self.name}:{model_version(self.model_path)}"
+
+    def vocab(self):
+        return self.spec(get_learner(self.model_path))["vocab"]
+
+    def spec(self, learn):
+        if self._spec_learner is not learn:
+            spec = preprocess.preprocess_spec(learn)
+            self._spec = scaled_spec(spec, self.size) if self.size else spec
+            self._spec_learner = learn
+        return self._spec
+
+    def predict_batch(self, imgs):
+        import torch
+
+        if not imgs:
+            return []
+        learn = get_learner(self.model_path)
+        spec = self.spec(learn)
+        model = learn.model.eval()
+        device = next(model.parameters()).device
+        activation = getattr(learn.loss_func, 'activation', lambda x: torch.softmax(x, dim=1))
+        with torch.inference_mode():
+            probs = activation(model(preprocess.to_normalized_batch(imgs, spec).to(device)))
+        return to_results(spec["vocab"], probs.tolist())
+
+
+# Exported graph taking a uint8 NCHW batch and returning probabilities (see export_model.py)
+class TorchScriptBackend:
+    def __init__(self, path, spec_path, name='torchscript'):
+        self.name = name
+        self.path = path
+        self.spec_path = spec_path
+        # Fail at selection time, not on the first request
+        get_model(self.path, _load_torchscript)
+
+    def version(self):
+        return ':'.join([self.name, model_version(self.path, _load_torchscript),
+                         model_version(self.spec_path, preprocess.load_spec)])
+
+    def vocab(self):
+        return get_model(self.spec_path, preprocess.load_spec)["vocab"]
+
+    def predict_batch(self, imgs):
+        import torch
+
+        if not imgs:
+            return []
+        module = get_model(self.path, _load_torchscript)
+        spec = get_model(self.spec_path, preprocess.load_spec)
+        with torch.inference_mode():
+            probs = module(preprocess.to_batch(imgs, spec))
+        return to_results(spec["vocab"], probs.tolist())
+
+
+class OnnxBackend:
+    def __init__(self, path, spec_path, name='onnx'):
+        self.name = name
+        self.path = path
+        self.spec_path = spec_path
+        get_model(self.path, _load_onnx)
+
+    def version(self):
+        return ':'.join([self.name, model_version(self.path, _load_onnx),
+                         model_version(self.spec_path, preprocess.load_spec)])
+
+    def vocab(self):
+        return get_model(self.spec_path, preprocess.load_spec)["vocab"]
+
+    def predict_batch(self, imgs):
+        if not imgs:
+            return []
+        session = get_model(self.path, _load_onnx)
+        spec = get_model(self.spec_path, preprocess.load_spec)
+        (probs,) = session.run(None, {'images': preprocess.to_batch(imgs, spec).numpy()})
+        return to_results(spec["vocab"], probs.tolist())
+
+
+# Result of a cascade: the usual {label: prob} dict plus the tier that produced it
+class CascadeResult(dict):
+    def __init__(self, result, tier):
+        super().__init__(result)
+        self.tier = tier
+
+
+class CascadeBackend:
+    def __init__(self, fast, full, min_confidence=CASCADE_MIN_CONFIDENCE, min_margin=CASCADE_MIN_MARGIN,
+                 stats_window=1000):
+        self.fast = fast
+        self.full = full
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self.name = f'cascade:{fast.name}>{full.name}'
+        self.concurrency = getattr(full, 'concurrency', 1)
+        self._answered = collections.Counter()
+        # Per-photo seconds spent in each tier
+        self._latency = {'fast': collections.deque(maxlen=stats_window), 'full': collections.deque(maxlen=stats_window)}
+        self._lock = threading.Lock()
+
+    # The thresholds change which model answers, so they are part of the version cached results are keyed by
+    def version(self):
+        return f"{self.name}:{self.fast.version()}:{self.full.version()}:{self.min_confidence}:{self.min_margin}"
+
+    def vocab(self):
+        return self.full.vocab()
+
+    def confident(self, result):
+        top = sorted(result.values(), reverse=True)[:2] + [0.0]
+        return top[0] >= self.min_confidence and top[0] - top[1] >= self.min_margin
+
+    def predict_batch(self, imgs):
+        if not imgs:
+            return []
+        start = time.perf_counter()
+        results = [CascadeResult(r, 'fast') for r in self.fast.predict_batch(imgs)]
+        fast_done = time.perf_counter()
+        unsure = [i for i, r in enumerate(results) if not self.confident(r)]
+        if unsure:
+            for i, r in zip(unsure, self.full.predict_batch([imgs[i] for i in unsure])):
+                results[i] = CascadeResult(r, 'full')
+        full_done = time.perf_counter()
+
+        with self._lock:
+            self._answered['fast'] += len(imgs) - len(unsure)
+            self._answered['full'] += len(unsure)
+            self._latency['fast'].extend([(fast_done - start) / len(imgs)] * len(imgs))
+            if unsure:
+                self._latency['full'].extend([(full_done - fast_done) / len(unsure)] * len(unsure))
+        return results
+
+    # Which tier answered how often, and what each tier costs per photo
+    def stats(self):
+        with self._lock:
+            answered = dict(self._answered)
+            latency = {tier: sorted(values) for tier, values in self._latency.items()}
+        total = sum(answered.values())
+        stats = {
+            "photos": total,
+            "answered_fast": answered.get('fast', 0),
+            "escalated": answered.get('full', 0),
+            "escalation_rate": answered.get('full', 0) / total if total else None,
+        }
+        for tier, values in latency.items():
+            stats[f"{tier}_p50_s"] = percentile(values, 0.50)
+            stats[f"{tier}_p95_s"] = percentile(values, 0.95)
+        return stats
+
+    def close(self):
+        for tier in (self.fast, self.full):
+            close = getattr(tier, 'close', None)
+            if close is not None:
+                close()
+
+
+def make_backend(name, model_path='export.pkl', export_dir=EXPORT_DIR, size=None):
+    if name == 'fastai':
+        return FastaiBackend(model_path)
+    if name == 'direct':
+        return DirectBackend(model_path, size)
+    if name not in ARTIFACTS:
+        raise ValueError(f"Unknown model backend: {name}")
+    path = os.path.join(export_dir, ARTIFACTS[name])
+    spec_path = os.path.join(export_dir, SPEC_FILE)
+    cls = OnnxBackend if name.startswith('onnx') else TorchScriptBackend
+    return cls(path, spec_path, name)
+
+
+# `backend` behind a cascade whose fast tier is `cascade_fast` on the same artifact, or `backend` alone when
+# the fast tier is unavailable
+def with_cascade(backend, cascade_fast, model_path='export.pkl', export_dir=EXPORT_DIR):
+    try:
+        if cascade_fast == 'direct' and hasattr(backend, 'scaled'):
+            # The pool's own workers run the reduced-size pass, so this process still never loads the Learner
+            fast = backend.scaled(CASCADE_FAST_SIZE or None)
+        else:
+            fast = make_backend(cascade_fast, model_path, export_dir, size=CASCADE_FAST_SIZE or None)
+    except (OSError, ImportError, RuntimeError, ValueError) as e:
+        logger.warning("Cascade fast tier %r unavailable (%s), serving %s alone", cascade_fast, e, backend.name)
+        return backend
+    return CascadeBackend(fast, backend)
+
+
+# The configured backend, or the fastai Learner when the exported artifacts can't be used;
+# the 'direct' backend runs in worker processes when SFIE_INFERENCE_WORKERS is set (see
+# inference_pool.py), hot-reloaded and A/B tested by model_manager.py when that is configured,
+# and wrapped in a cascade behind `cascade_fast` when one is configured and available (each version
+# separately under the model manager)
+def get_backend(name=BACKEND, model_path='export.pkl', export_dir=EXPORT_DIR, cascade_fast=CASCADE_FAST):
+    from inference_pool import WORKERS, ProcessPoolBackend
+    from model_manager import MANAGED, ModelManager, version_backend
+
+    backend = None
+    if WORKERS and name != 'direct':
+        # The workers run the direct pipeline; serving 'fastai' from them would silently swap fastai's
+        # per-item preprocessing for preprocess.py's
+        logger.warning("SFIE_INFERENCE_WORKERS needs SFIE_MODEL_BACKEND=direct; serving %r in-process", name)
+    if MANAGED:
+        make_version_backend = version_backend
+        if cascade_fast == 'direct':
+            # Every version gets its own fast tier on its own snapshot, so the fast answers follow hot reloads
+            # and the A/B split, and a photo's two tiers always come from the same version
+            def make_version_backend(path, backend_name):
+                return with_cascade(version_backend(path, backend_name), cascade_fast, path)
+        elif cascade_fast:
+            # The exported fast tiers are built from export.pkl offline and would not follow a swap
+            logger.warning("Cascade fast tier %r does not follow hot reloads; only 'direct' can be combined "
+                           "with the model manager, serving without a cascade", cascade_fast)
+        try:
+            return ModelManager(model_path, name, make_version_backend=make_version_backend)
+        except (OSError, ImportError, RuntimeError) as e:
+            logger.warning("Model manager unavailable (%s), serving %s without hot reload", e, model_path)
+    if backend is None and WORKERS and name == 'direct':
+        try:
+            backend = ProcessPoolBackend(model_path, WORKERS)
+        except (OSError, ImportError, RuntimeError) as e:
+            logger.warning("Inference worker pool unavailable (%s), predicting in-process", e)
+    if backend is None:
+        try:
+            backend = make_backend(name, model_path, export_dir)
+        except (OSError, ImportError, RuntimeError) as e:
+            logger.warning("Model backend %r unavailable (%s), falling back to fastai", name, e)
+            backend = FastaiBackend(model_path)
+    if not cascade_fast:
+        return backend
+    return with_cascade(backend, cascade_fast, model_path, export_dir)
@@ -0,0 +1,283 @@
+"""Generate skincare recommendations offline for many questionnaire profiles.
+
+    python batch_llm.py profiles.csv -o recommendations.jsonl --concurrency 8 --rate 2
+    python batch_llm.py profiles.jsonl -o recommendations.jsonl --cache
+
+Each profile holds the questionnaire answers (see prompts.ANSWER_FIELDS) and an optional "id";
+in a CSV the multi-select answers are JSON arrays or ';'-separated. Prompts are built exactly
+like the apps' "Get Recommendations" step. Requests share one pooled async client, at most
+--concurrency are in flight and at most --rate start per second; 429s, 5xx and timeouts are
+retried with jittered exponential backoff. Results are appended as each one finishes, and
+re-running with the same output skips profiles already answered.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import sys
+import time
+
+import httpx
+
+import llm_client
+from llm_client import build_request, request_headers
+from metrics import percentile
+from prompts import ANSWER_FIELDS, LIST_FIELDS, build_prompt
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class _Retryable(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _list_answer(value):
+    value = (value or '').strip()
+    if value.startswith('['):
+        return json.loads(value)
+    return [v.strip() for v in value.split(';') if v.strip()]
+
+
+# Profiles as (id, answers); the id defaults to the row/line number
+def read_profiles(path):
+    profiles = []
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            for i, row in enumerate(csv.DictReader(f), 1):
+                answers = {field: _list_answer(row.get(field)) if field in LIST_FIELDS else (row.get(field) or '')
+                           for field in ANSWER_FIELDS}
+                profiles.append((str(row.get('id') or i), answers))
+        else:
+            for i, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                answers = {field: row.get(field, [] if field in LIST_FIELDS else '') for field in ANSWER_FIELDS}
+                profiles.append((str(row.get('id', i)), answers))
+    return profiles
+
+
+# Appends one JSON object per finished profile; done() gives the ids answered by earlier runs
+class JsonlSink:
+    def __init__(self, path):
+        self.path = path
+
+    def done(self):
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, encoding='utf-8') as f:
+            return {row['id'] for row in map(json.loads, filter(str.strip, f)) if row.get('error') is None}
+
+    def __enter__(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+    def write(self, row):
+        self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+
+# Token bucket: lets `burst` requests through at once, then `rate` per second
+class RateLimiter:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After', ''))
+    except ValueError:
+        return None
+
+
+async def _complete(client, url, prompt, api_key):
+    try:
+        response = await client.post(url, json=build_request(prompt), headers=request_headers(api_key))
+    except httpx.TimeoutException:
+        raise _Retryable("The request timed out")
+    except httpx.TransportError as error:
+        raise _Retryable(f"The request failed: {error}")
+    if response.status_code in RETRY_STATUSES:
+        raise _Retryable(f"The request failed with status code: {response.status_code}", _retry_after(response))
+    if response.is_error:
+        raise llm_client.LLMError(f"The request failed with status code: {response.status_code}\n{response.text}")
+    return response.json()['choices'][0]['message']['content']
+
+
+class BatchRunner:
+    def __init__(self, client, url, api_key, concurrency=8, rate=0, retries=5, backoff=1.0, max_backoff=60.0,
+                 cache=None):
+        self.client = client
+        self.url = url
+        self.api_key = api_key
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cache = cache
+        self._slots = asyncio.Semaphore(concurrency)
+        self._limiter = RateLimiter(rate, burst=max(1, min(concurrency, int(rate) or 1)))
+        # Per answered profile: seconds its requests took once they had a slot (summed over attempts), and
+        # seconds from its first request to the answer, which adds the backoff and waits between attempts.
+        # Neither counts the wait for the first slot, which with every profile queued up front is the run so far.
+        self.latencies = []
+        self.elapsed = []
+        self.attempts = 0
+        self.cache_hits = 0
+
+    # Exponential backoff with full jitter, or the server's Retry-After when it sends one
+    def _delay(self, attempt, retry_after):
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def run_one(self, profile_id, answers):
+        prompt = build_prompt(answers)
+        key = None
+        if self.cache is not None:
+            from llm_cache import cache_key
+
+            key = cache_key(answers, prompt, self.url)
+            response = await asyncio.to_thread(self.cache.get, key)
+            if response is not None:
+                self.cache_hits += 1
+                return {"id": profile_id, "response": response, "error": None, "attempts": 0,
+                        "latency_s": 0.0, "elapsed_s": 0.0, "cached": True}
+
+        attempt = 0
+        latency = 0.0
+        start = None
+        while True:
+            await self._limiter.acquire()
+            self.attempts += 1
+            try:
+                async with self._slots:
+                    sent = time.perf_counter()
+                    if start is None:
+                        start = sent
+                    try:
+                        response = await _complete(self.client, self.url, prompt, self.api_key)
+                    finally:
+                        latency += time.perf_counter() - sent
+            except _Retryable as error:
+                if attempt >= self.retries:
+                    return self._failed(profile_id, str(error), attempt + 1, latency, start)
+                await asyncio.sleep(self._delay(attempt, error.retry_after))
+                attempt += 1
+                continue
+            except (llm_client.LLMError, httpx.HTTPError, KeyError, ValueError) as error:
+                return self._failed(profile_id, str(error), attempt + 1, latency, start)
+            break
+
+        elapsed = time.perf_counter() - start
+        self.latencies.append(latency)
+        self.elapsed.append(elapsed)
+        if key is not None:
+            await asyncio.to_thread(self.cache.put, key, response)
+        return {"id": profile_id, "response": response, "error": None, "attempts": attempt + 1,
+                "latency_s": round(latency, 3), "elapsed_s": round(elapsed, 3), "cached": False}
+
+    def _failed(self, profile_id, error, attempts, latency, start):
+        return {"id": profile_id, "response": None, "error": error, "attempts": attempts,
+                "latency_s": round(latency, 3), "elapsed_s": round(time.perf_counter() - start, 3), "cached": False}
+
+    # Run every profile, writing each result as soon as it is ready (so output order is completion order)
+    async def run(self, profiles, sink, log_every=10.0):
+        tasks = [asyncio.create_task(self.run_one(profile_id, answers)) for profile_id, answers in profiles]
+        start = last_log = time.perf_counter()
+        failed = 0
+        for finished, task in enumerate(asyncio.as_completed(tasks), 1):
+            row = await task
+            failed += row["error"] is not None
+            sink.write(row)
+            now = time.perf_counter()
+            if now - last_log >= log_every:
+                print(f"{finished}/{len(tasks)} profiles, {finished / (now - start):.2f} profiles/sec",
+                      file=sys.stderr)
+                last_log = now
+        return len(tasks), failed, time.perf_counter() - start
+
+
+def _client(concurrency):
+    return httpx.AsyncClient(
+        http2=llm_client.http2_available(),
+        verify=llm_client.verify_tls(),
+        timeout=httpx.Timeout(llm_client.READ_TIMEOUT, connect=llm_client.CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency,
+                            keepalive_expiry=llm_client.KEEPALIVE_EXPIRY),
+    )
+
+
+async def _main(args, profiles):
+    cache = None
+    if args.cache:
+        from llm_cache import get_cache
+        cache = get_cache()
+    async with _client(args.concurrency) as client:
+        runner = BatchRunner(client, args.url, args.api_key, args.concurrency, args.rate, args.retries,
+                             args.backoff, cache=cache)
+        with JsonlSink(args.output) as sink:
+            total, failed, elapsed = await runner.run(profiles, sink)
+
+    latencies, waits = sorted(runner.latencies), sorted(runner.elapsed)
+    print(f"Answered {total - failed}/{total} profiles in {elapsed:.1f}s ({total / elapsed:.2f} profiles/sec), "
+          f"{runner.attempts} requests, {runner.cache_hits} cache hits", file=sys.stderr)
+    if latencies:
+        print(f"Request latency p50 {percentile(latencies, 0.50):.2f}s, p95 {percentile(latencies, 0.95):.2f}s "
+              f"(summed over retries); first request to answer p50 {percentile(waits, 0.50):.2f}s, "
+              f"p95 {percentile(waits, 0.95):.2f}s (adding backoff between retries)", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('profiles', help="questionnaire profiles (.csv or .jsonl)")
+    parser.add_argument('-o', '--output', default='recommendations.jsonl')
+    parser.add_argument('--url', default=llm_client.LLM_URL)
+    parser.add_argument('--api-key', default=os.environ.get('SFIE_LLM_API_KEY', ''),
+                        help="defaults to $SFIE_LLM_API_KEY")
+    parser.add_argument('--concurrency', type=int, default=llm_client.MAX_CONCURRENCY,
+                        help="max requests in flight")
+    parser.add_argument('--rate', type=float, default=0, help="max requests started per second (0: unlimited)")
+    parser.add_argument('--retries', type=int, default=5)
+    parser.add_argument('--backoff', type=float, default=1.0, help="base backoff in seconds, doubled per retry")
+    parser.add_argument('--cache', action='store_true', help="share the apps' response cache (llm_cache.py)")
+    args = parser.parse_args()
+    if not args.url:
+        parser.error("no endpoint: pass --url or set SFIE_LLM_URL")
+
+    sink = JsonlSink(args.output)
+    done = sink.done()
+    profiles = [(i, answers) for i, answers in read_profiles(args.profiles) if i not in done]
+    if done:
+        print(f"Resuming: {len(done)} profiles already answered", file=sys.stderr)
+    if not profiles:
+        print("Nothing to do", file=sys.stderr)
+        return
+    asyncio.run(_main(args, profiles))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Score a directory (or manifest) of face photos offline with the analyzer's model.
+
+    python batch_score.py photos/ -o scores.csv
+    python batch_score.py manifest.txt -o scores.parquet --batch-size 64 --workers 8
+
+Photos are decoded exactly like uploads in app.py (ingest.py) and classified by the same
+backend predict() uses (SFIE_MODEL_BACKEND, with the fastai Learner as fallback). Results are
+appended as each batch finishes. Re-running with the same output skips photos already scored
+and retries the ones that failed.
+A .parquet output is a directory of part files, one per batch.
+"""
+import argparse
+import collections
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import BACKEND, get_backend
+from face_regions import FACE_CROP, predict_regions_many
+from ingest import ingest_upload
+from inference import top_k
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+# Paths from a directory (recursive) or a manifest: one path per line, or a CSV with a "path" column
+def list_images(source):
+    if os.path.isdir(source):
+        paths = (p for p in glob.iglob(os.path.join(source, '**', '*'), recursive=True)
+                 if p.lower().endswith(IMAGE_EXTENSIONS))
+        return sorted(paths)
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline='') as f:
+        if source.lower().endswith('.csv'):
+            rows = (row['path'] for row in csv.DictReader(f))
+        else:
+            rows = (line.strip() for line in f)
+        return [p if os.path.isabs(p) else os.path.join(base, p) for p in rows if p]
+
+
+def _columns(k):
+    return ['path'] + [c for i in range(1, k + 1) for c in (f'label_{i}', f'prob_{i}')] + ['error']
+
+
+class CsvSink:
+    def __init__(self, path, k):
+        self.path = path
+        self.columns = _columns(k)
+
+    def done(self):
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, newline='') as f:
+            # An empty error column is a scored photo; failed ones are tried again
+            return {row['path'] for row in csv.DictReader(f) if not row['error']}
+
+    def write(self, rows):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            if new:
+                writer.writeheader()
+            writer.writerows(rows)
+
+
+class ParquetSink:
+    def __init__(self, path, k):
+        import pandas as pd  # noqa: F401 (pyarrow is needed too)
+
+        self.path = path
+        self.columns = _columns(k)
+        os.makedirs(path, exist_ok=True)
+        self._part = len(glob.glob(os.path.join(path, 'part-*.parquet')))
+
+    def done(self):
+        import pandas as pd
+
+        parts = sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+        if not parts:
+            return set()
+        df = pd.concat([pd.read_parquet(p, columns=['path', 'error']) for p in parts])
+        return set(df.loc[df['error'].isna(), 'path'])
+
+    def write(self, rows):
+        import pandas as pd
+
+        pd.DataFrame(rows, columns=self.columns).to_parquet(
+            os.path.join(self.path, f'part-{self._part:05d}.parquet'), index=False)
+        self._part += 1
+
+
+def _decode(path):
+    with open(path, 'rb') as f:
+        return ingest_upload(f).model_image
+
+
+# Decode on a thread pool (PIL releases the GIL) with at most `prefetch` photos in flight, in input order
+def iter_decoded(paths, workers, prefetch):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for path in paths:
+            pending.append((path, pool.submit(_decode, path)))
+            if len(pending) >= prefetch:
+                yield _result(*pending.popleft())
+        while pending:
+            yield _result(*pending.popleft())
+
+
+def _result(path, future):
+    try:
+        return path, future.result(), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def batches(decoded, size):
+    batch = []
+    for item in decoded:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Adapter giving a backend the predict_many() interface face_regions expects from the inference server
+class Predictor:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def predict_many(self, imgs):
+        return self.backend.predict_batch(imgs)
+
+
+def score(paths, sink, backend, batch_size=32, workers=4, prefetch=128, k=3, face_crop=FACE_CROP,
+          log_every=10.0):
+    predictor = Predictor(backend)
+    start = last_log = time.perf_counter()
+    scored = 0
+    for batch in batches(iter_decoded(paths, workers, max(prefetch, batch_size)), batch_size):
+        ok = [(path, img) for path, img, error in batch if error is None]
+        rows = [{'path': path, 'error': error} for path, _, error in batch if error is not None]
+        if ok:
+            results = predict_regions_many(predictor, [img for _, img in ok], face_crop)
+            for (path, _), result in zip(ok, results):
+                row = {'path': path, 'error': None}
+                for i, (label, prob) in enumerate(top_k(result.result, k), 1):
+                    row[f'label_{i}'], row[f'prob_{i}'] = label, round(prob, 6)
+                rows.append(row)
+        sink.write(rows)
+
+        scored += len(batch)
+        now = time.perf_counter()
+        if now - last_log >= log_every:
+            print(f"{scored}/{len(paths)} photos, {scored / (now - start):.1f} images/sec", file=sys.stderr)
+            last_log = now
+    elapsed = time.perf_counter() - start
+    return scored, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', help="directory of photos, or a manifest (.txt paths or .csv with a path column)")
+    parser.add_argument('-o', '--output', default='scores.csv', help="output .csv file or .parquet directory")
+    parser.add_argument('--model', default='export.pkl')
+    parser.add_argument('--backend', default=BACKEND)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help="decoding threads")
+    parser.add_argument('--prefetch', type=int, default=128, help="max photos decoded ahead of inference")
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--face-crop', default=FACE_CROP, choices=['off', 'face', 'zones'])
+    args = parser.parse_args()
+
+    sink_cls = ParquetSink if args.output.lower().endswith('.parquet') else CsvSink
+    sink = sink_cls(args.output, args.top_k)
+    done = sink.done()
+    paths = [p for p in list_images(args.source) if p not in done]
+    if done:
+        print(f"Resuming: {len(done)} photos already scored", file=sys.stderr)
+    if not paths:
+        print("Nothing to score", file=sys.stderr)
+        return
+
+    backend = get_backend(args.backend, model_path=args.model)
+    scored, elapsed = score(paths, sink, backend, args.batch_size, args.workers, args.prefetch, args.top_k,
+                            args.face_crop)
+    print(f"Scored {scored} photos in {elapsed:.1f}s ({scored / elapsed:.1f} images/sec) with {backend.name}",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
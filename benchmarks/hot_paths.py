@@ -0,0 +1,247 @@
+"""Latency and throughput benchmarks for the analyzer's and assistant's hot paths.
+
+Covers model load, upload decoding, single and batched prediction on the bundled sample
+JPEGs, recommendation catalog compile/load/lookup, is_psychology_related on short and long
+prompts, and LLM client round trips against mock_llm_server.py (so only client overhead is
+measured). Each case reports p50/p95/p99 latency, throughput and RSS; cases whose
+dependencies are missing are reported as skipped.
+
+    python benchmarks/hot_paths.py --json bench.json
+    python benchmarks/hot_paths.py --cases relevance llm --baseline bench.json --threshold 0.15
+
+With --baseline, any case whose p50 grew (or throughput fell) by more than the threshold
+is listed and the exit status is 1, so two commits can be compared in CI.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import percentile  # noqa: E402
+from model_registry import peak_rss_mb, rss_mb  # noqa: E402
+
+SHORT_PROMPT = "How does stress affect my acne?"
+LONG_PROMPT = ("My skin has been dry and flaky around the nose, and I wonder whether my new routine, "
+               "the weather or my diet is to blame. ") * 200
+
+
+# Time `fn` `repeat` times after `warmup` untimed calls; `items` is how many units one call handles
+def measure(fn, repeat, warmup=1, items=1):
+    for _ in range(warmup):
+        fn()
+    rss_before = rss_mb()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    rss_after = rss_mb()
+    samples.sort()
+    total = sum(samples)
+    return {
+        "repeat": repeat,
+        "items": items,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "mean_ms": total / repeat * 1000,
+        "throughput_per_s": repeat * items / total if total else None,
+        "rss_mb": rss_after,
+        "rss_delta_mb": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+    }
+
+
+def sample_images():
+    return sorted(glob.glob(os.path.join(ROOT, '*.jpg')))
+
+
+def _decoded_samples():
+    from ingest import ingest_upload
+
+    imgs = []
+    for path in sample_images():
+        with open(path, 'rb') as f:
+            imgs.append(ingest_upload(f).model_image)
+    return imgs
+
+
+def bench_model(args):
+    from model_registry import unpickle_learner
+
+    path = os.path.join(ROOT, args.model)
+    # Unpickles every time, unlike get_learner(): this is the cold-start cost each process pays
+    return {"model_load": measure(lambda: unpickle_learner(path), args.load_repeat, warmup=0)}
+
+
+def bench_decode(args):
+    from ingest import ingest_upload
+
+    paths = sample_images()
+
+    def decode():
+        for path in paths:
+            with open(path, 'rb') as f:
+                ingest_upload(f)
+    return {"decode_upload": measure(decode, args.repeat, items=len(paths))}
+
+
+def bench_predict(args):
+    from backends import get_backend
+
+    backend = get_backend(args.backend, model_path=os.path.join(ROOT, args.model))
+    imgs = _decoded_samples()
+    results = {}
+    results[f"predict_single[{backend.name}]"] = measure(
+        lambda: [backend.predict_batch([img]) for img in imgs], args.repeat, items=len(imgs))
+    for size in args.batch_sizes:
+        batch = [imgs[i % len(imgs)] for i in range(size)]
+        results[f"predict_batch{size}[{backend.name}]"] = measure(
+            lambda: backend.predict_batch(batch), max(1, args.repeat // 4), items=size)
+    return results
+
+
+def bench_catalog(args):
+    import catalog
+
+    path = os.path.abspath(os.path.join(ROOT, 'recommendation.xlsx'))
+    mtime = os.path.getmtime(path)
+    compiled = catalog.compile_catalog(path, mtime)
+    cache_path = catalog.cache_file(path)
+    catalog.write_cache(cache_path, compiled)
+    warm = catalog.get_catalog(path)
+
+    def lookup():
+        for c in warm.classes:
+            warm.for_class(c)
+    return {
+        "catalog_compile": measure(lambda: catalog.compile_catalog(path, mtime), max(1, args.repeat // 10)),
+        "catalog_cached_load": measure(lambda: catalog.read_cache(cache_path, mtime), args.repeat),
+        "catalog_lookup": measure(lookup, args.repeat * 10, items=len(warm.classes)),
+    }
+
+
+def bench_relevance(args):
+    from relevance import is_psychology_related
+
+    return {
+        "relevance_short": measure(lambda: is_psychology_related(SHORT_PROMPT), args.repeat * 100),
+        "relevance_long": measure(lambda: is_psychology_related(LONG_PROMPT), args.repeat * 10),
+    }
+
+
+def bench_llm(args):
+    import llm_client
+    from mock_llm_server import MockConfig, serve_in_thread
+
+    # No server-side latency and instant tokens: what's left is the client's own cost per call
+    server = serve_in_thread(MockConfig(latency='0', token_rate=0, tokens=args.llm_tokens))
+    try:
+        return {
+            "llm_complete": measure(lambda: llm_client.complete("benchmark", "key", server.url), args.repeat),
+            "llm_stream": measure(lambda: list(llm_client.iter_completion("benchmark", "key", server.url)),
+                                  args.repeat, items=args.llm_tokens),
+        }
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+CASES = {
+    "model": bench_model,
+    "decode": bench_decode,
+    "predict": bench_predict,
+    "catalog": bench_catalog,
+    "relevance": bench_relevance,
+    "llm": bench_llm,
+}
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    results = {}
+    for name in args.cases:
+        start = time.perf_counter()
+        try:
+            case_results = CASES[name](args)
+        except (ImportError, OSError, RuntimeError) as e:
+            print(f"{name:<28} skipped: {type(e).__name__}: {e}", file=sys.stderr)
+            results[name] = {"skipped": f"{type(e).__name__}: {e}"}
+            continue
+        for case, r in case_results.items():
+            results[case] = r
+            print(f"{case:<28} p50 {r['p50_ms']:9.3f} ms  p95 {r['p95_ms']:9.3f} ms  "
+                  f"{r['throughput_per_s']:10.1f}/s  rss {r['rss_mb'] or 0:7.1f} MB")
+        print(f"{'':<28} ({name}: {time.perf_counter() - start:.1f}s)", file=sys.stderr)
+    return {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "created": time.time(),
+        "peak_rss_mb": peak_rss_mb(),
+        "cases": results,
+    }
+
+
+# Cases slower (p50) or lower-throughput than the baseline by more than `threshold` (a fraction)
+def regressions(current, baseline, threshold):
+    found = []
+    for case, r in current["cases"].items():
+        old = baseline["cases"].get(case)
+        if not old or "skipped" in old or "skipped" in r:
+            continue
+        if r["p50_ms"] > old["p50_ms"] * (1 + threshold):
+            found.append((case, "p50_ms", old["p50_ms"], r["p50_ms"]))
+        elif old["throughput_per_s"] and r["throughput_per_s"] < old["throughput_per_s"] / (1 + threshold):
+            found.append((case, "throughput_per_s", old["throughput_per_s"], r["throughput_per_s"]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cases', nargs='*', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--model', default='export.pkl')
+    parser.add_argument('--backend', default=os.environ.get('SFIE_MODEL_BACKEND', 'fastai'))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--load-repeat', type=int, default=3)
+    parser.add_argument('--batch-sizes', type=int, nargs='*', default=[8, 32])
+    parser.add_argument('--llm-tokens', type=int, default=200)
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', help="results JSON from an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed slowdown, as a fraction")
+    args = parser.parse_args()
+
+    current = run(args)
+    print(f"\nPeak RSS: {current['peak_rss_mb'] or 0:.1f} MB")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(current, baseline, args.threshold)
+        print(f"\nCompared with {baseline.get('commit') or args.baseline} (threshold {args.threshold:.0%}):")
+        for case, metric, old, new in found:
+            print(f"  REGRESSION {case}: {metric} {old:.3f} -> {new:.3f} ({new / old - 1:+.0%})")
+        if not found:
+            print("  no regressions")
+        sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Import-time profile of the app's cold start.
+
+Runs ``python -X importtime`` in a fresh interpreter for the modules app.py imports at
+top level (what every page pays, including the LLM-only ones) and for a baseline of
+Streamlit alone, then prints the slowest imports by cumulative time.
+
+    python benchmarks/import_profile.py
+    python benchmarks/import_profile.py --modules fastai.vision.all --top 30
+"""
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Modules imported at the top level of a script (not inside functions or page branches)
+def top_level_imports(path):
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+# Import `modules` in a clean interpreter; returns [(module, self_us, cumulative_us)]
+def profile(modules):
+    code = ''.join(f'import {m}\n' for m in modules)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nested imports are indented by two spaces per level after the single separator space
+        rows.append((name.rstrip()[1:], int(self_us), int(cumulative_us)))
+    return rows
+
+
+def total_ms(rows):
+    # Top-level entries have no indentation; their cumulative times add up to the whole import
+    return sum(cum for name, _, cum in rows if not name.startswith(' ')) / 1000
+
+
+def report(label, modules, top):
+    rows = profile(modules)
+    print(f"\n{label}: {total_ms(rows):.1f} ms ({len(rows)} modules)")
+    for name, _, cum in sorted(rows, key=lambda r: r[2], reverse=True)[:top]:
+        print(f"  {cum / 1000:9.1f} ms  {name.strip()}")
+    return {"modules": modules, "total_ms": total_ms(rows), "imported": len(rows)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--script', default=os.path.join(ROOT, 'app.py'))
+    parser.add_argument('--modules', nargs='*', help="profile these modules instead of the script's imports")
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--json', help="write the totals to this file")
+    args = parser.parse_args()
+
+    results = {"baseline": report("streamlit only", ['streamlit'], args.top)}
+    modules = args.modules or top_level_imports(args.script)
+    results["target"] = report(' '.join(modules) if args.modules else os.path.basename(args.script), modules,
+                               args.top)
+    overhead = results["target"]["total_ms"] - results["baseline"]["total_ms"]
+    print(f"\nOverhead over streamlit: {overhead:.1f} ms")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
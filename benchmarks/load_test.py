@@ -0,0 +1,392 @@
+"""Load test: many concurrent browser sessions against one Streamlit server process.
+
+Starts ``streamlit run app.py`` with SFIE_LLM_URL pointed at mock_llm_server.py, then drives
+N headless sessions over Streamlit's websocket protocol (the messages a browser sends), so
+each session gets its own script thread in the one server process, as in production.
+streamlit.testing's AppTest swaps process-wide globals on every run, so AppTests on
+concurrent threads corrupt each other and can't model this.
+
+A session opens the Home page (model and catalog load), uploads a sample JPEG and presses
+Predict, then switches to the Personalized Assistant and clicks through the questionnaire,
+including the analyzer screen, to the LLM-backed "Get Recommendations" page.
+
+    pip install -r requirements.txt -r benchmarks/requirements.txt
+    python benchmarks/load_test.py --sessions 1 4 16 --flows 2
+    python benchmarks/load_test.py --sessions 8 --only questionnaire --llm-latency lognormal:1.0,0.4
+
+The sessions speak the websocket protocol through the `websockets` package, which the app itself
+doesn't need; benchmarks/requirements.txt adds it.
+
+Per concurrency level it reports sessions/sec, per-step p50/p95/p99 latency as seen by the
+client, errors, and the server's RSS growth and peak.
+"""
+import argparse
+import asyncio
+import collections
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import percentile  # noqa: E402
+
+FLOWS = ('home', 'questionnaire')
+# Buttons from the first questionnaire screen to the recommendations page
+QUESTIONNAIRE_STEPS = ["Get Started", "Next", "Next", "Next", "Next", "Next", "Next", "Analyze",
+                       "Get Recommendations"]
+
+
+class SessionError(Exception):
+    pass
+
+
+# Resident set size of another process in MB, from /proc (None elsewhere)
+def process_rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = collections.defaultdict(list)
+        self.errors = collections.Counter()
+
+    async def time(self, step, coro):
+        start = time.perf_counter()
+        result = await coro
+        self.samples[step].append(time.perf_counter() - start)
+        return result
+
+    def summary(self):
+        steps = {}
+        for step, values in self.samples.items():
+            values = sorted(values)
+            steps[step] = {"count": len(values), "p50_ms": percentile(values, 0.50) * 1000,
+                           "p95_ms": percentile(values, 0.95) * 1000, "p99_ms": percentile(values, 0.99) * 1000}
+        return steps
+
+
+# The elements one script run rendered, in order, as (type, proto)
+class Page:
+    def __init__(self, elements):
+        self.elements = elements
+
+    def of_type(self, kind):
+        return [proto for ty, proto in self.elements if ty == kind]
+
+    def widget(self, kind, label=None):
+        for proto in self.of_type(kind):
+            if label is None or proto.label == label:
+                return proto
+        raise SessionError(f"No {kind} {label!r} on this page (headers: {self.headers()})")
+
+    def headers(self):
+        return [h.body for h in self.of_type('heading')]
+
+    def check(self):
+        exceptions = self.of_type('exception')
+        if exceptions:
+            raise SessionError(f"{exceptions[0].type}: {exceptions[0].message}")
+        return self
+
+
+# One browser tab, speaking Streamlit's protobuf websocket protocol
+class HeadlessSession:
+    def __init__(self, base_url, timeout, selectbox_by_index=False):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.selectbox_by_index = selectbox_by_index
+        self.session_id = None
+
+    async def __aenter__(self):
+        import websockets
+
+        self._ws = await websockets.connect(self.base_url.replace('http', 'ws', 1) + '/_stcore/stream',
+                                            max_size=None)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._ws.close()
+
+    async def _recv(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        msg = ForwardMsg()
+        msg.ParseFromString(await asyncio.wait_for(self._ws.recv(), self.timeout))
+        if msg.WhichOneof('type') == 'new_session':
+            self.session_id = msg.new_session.initialize.session_id
+        return msg
+
+    async def _send(self, back_msg):
+        await self._ws.send(back_msg.SerializeToString())
+
+    # Rerun the script with these widget states and collect what it renders
+    async def rerun(self, *widget_states, check=True):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ''
+        msg.rerun_script.widget_states.widgets.extend(widget_states)
+        await self._send(msg)
+        elements = []
+        while True:
+            fwd = await self._recv()
+            kind = fwd.WhichOneof('type')
+            if kind == 'script_finished':
+                page = Page(elements)
+                return page.check() if check else page
+            if kind == 'delta' and fwd.delta.WhichOneof('type') == 'new_element':
+                element = fwd.delta.new_element
+                ty = element.WhichOneof('type')
+                elements.append((ty, getattr(element, ty)))
+
+    async def click(self, page, label, *widget_states):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        return await self.rerun(WidgetState(id=page.widget('button', label).id, trigger_value=True), *widget_states)
+
+    def select(self, proto, option):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        # Newer Streamlit sends the option itself, older versions its index
+        if self.selectbox_by_index:
+            return WidgetState(id=proto.id, int_value=list(proto.options).index(option))
+        return WidgetState(id=proto.id, string_value=option)
+
+    # Upload a file the way the browser does: ask for an upload URL, PUT the bytes, return the widget state
+    async def upload(self, page, path):
+        import httpx
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        uploader = page.widget('file_uploader')
+        name = os.path.basename(path)
+        request = BackMsg()
+        request.file_urls_request.request_id = uuid.uuid4().hex
+        request.file_urls_request.file_names.append(name)
+        request.file_urls_request.session_id = self.session_id
+        await self._send(request)
+        while True:
+            fwd = await self._recv()
+            if fwd.WhichOneof('type') == 'file_urls_response' and \
+                    fwd.file_urls_response.response_id == request.file_urls_request.request_id:
+                break
+        if fwd.file_urls_response.error_msg:
+            raise SessionError(fwd.file_urls_response.error_msg)
+        urls = fwd.file_urls_response.file_urls[0]
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout) as client:
+            response = await client.put(urls.upload_url, files={'file': (name, data, 'image/jpeg')})
+            response.raise_for_status()
+
+        state = WidgetState(id=uploader.id)
+        info = state.file_uploader_state_value.uploaded_file_info.add()
+        info.file_id, info.name, info.size = urls.file_id, name, len(data)
+        info.file_urls.CopyFrom(urls)
+        return state
+
+
+async def home_flow(session, recorder, sample):
+    page = await recorder.time('home_page', session.rerun())
+    uploaded = await recorder.time('upload', session.upload(page, sample))
+    page = await recorder.time('rerun', session.rerun(uploaded))
+    return await recorder.time('predict', session.click(page, "Predict", uploaded))
+
+
+# How llm_client's LLMError messages start
+LLM_ERRORS = ("The request failed", "The request timed out")
+
+
+async def questionnaire_flow(session, recorder, page):
+    from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+    page = await recorder.time('rerun', session.rerun(
+        session.select(page.widget('selectbox', "Skin Analyzer CV"), "Personalized Assistant")))
+    for label in QUESTIONNAIRE_STEPS:
+        # A button selects the next screen while the current one renders; it shows on the next rerun
+        await recorder.time('rerun', session.click(page, label))
+        page = await recorder.time('rerun', session.rerun())
+
+    api_key = WidgetState(id=page.widget('text_input', "Enter your API key:").id, string_value="load-test-key")
+    page = await recorder.time('recommendations', session.rerun(api_key))
+    # LLM errors come back as text: an st.error alert without streaming, and with it (the default) the
+    # end of the streamed markdown, after any tokens that arrived before the failure
+    bodies = [e.body for e in page.of_type('alert') + page.of_type('markdown')]
+    errors = [body[body.index(e):].splitlines()[0] for body in bodies for e in LLM_ERRORS if e in body]
+    if errors:
+        raise SessionError(errors[0])
+
+
+async def run_session(args, base_url, recorder, sample, selectbox_by_index):
+    start = time.perf_counter()
+    try:
+        async with HeadlessSession(base_url, args.timeout, selectbox_by_index) as session:
+            if 'home' in args.only:
+                page = await home_flow(session, recorder, sample)
+            else:
+                page = await session.rerun(check=False)
+            if 'questionnaire' in args.only:
+                await questionnaire_flow(session, recorder, page)
+    except Exception as e:
+        recorder.errors[f"{type(e).__name__}: {e}"] += 1
+        return False
+    recorder.samples['session'].append(time.perf_counter() - start)
+    return True
+
+
+# Which encoding this Streamlit version expects for selectbox values
+async def detect_selectbox_encoding(base_url, timeout):
+    for by_index in (False, True):
+        async with HeadlessSession(base_url, timeout, by_index) as session:
+            page = await session.rerun(check=False)
+            page = await session.rerun(session.select(page.widget('selectbox', "Skin Analyzer CV"),
+                                                      "Personalized Assistant"), check=False)
+            if any(s.label == "Select an AI Agent" for s in page.of_type('selectbox')):
+                return by_index
+    raise SessionError("Could not switch to the Personalized Assistant page")
+
+
+async def run_level(args, base_url, server_pid, sessions, samples, selectbox_by_index):
+    recorder = Recorder()
+    rss_before = process_rss_mb(server_pid)
+    peak = [rss_before or 0]
+
+    async def sample_rss():
+        while True:
+            peak[0] = max(peak[0], process_rss_mb(server_pid) or 0)
+            await asyncio.sleep(0.25)
+
+    async def worker(slot):
+        ok = 0
+        for i in range(args.flows):
+            ok += await run_session(args, base_url, recorder, samples[(slot + i) % len(samples)], selectbox_by_index)
+        return ok
+
+    sampler = asyncio.create_task(sample_rss())
+    start = time.perf_counter()
+    ok = sum(await asyncio.gather(*(worker(slot) for slot in range(sessions))))
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    rss_after = process_rss_mb(server_pid)
+    total = sessions * args.flows
+    return {
+        "sessions": sessions,
+        "completed": ok,
+        "failed": total - ok,
+        "seconds": elapsed,
+        "sessions_per_s": ok / elapsed if elapsed else None,
+        "server_rss_mb": rss_after,
+        "server_rss_growth_mb": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+        "server_peak_rss_mb": peak[0] or None,
+        "steps": recorder.summary(),
+        "errors": dict(recorder.errors.most_common(5)),
+    }
+
+
+def report(level):
+    print(f"\n{level['sessions']} concurrent sessions: {level['completed']} ok, {level['failed']} failed, "
+          f"{level['sessions_per_s'] or 0:.2f} sessions/s, server rss {level['server_rss_mb'] or 0:.0f} MB "
+          f"({level['server_rss_growth_mb'] or 0:+.1f} MB, peak {level['server_peak_rss_mb'] or 0:.0f} MB)")
+    for step, s in sorted(level["steps"].items()):
+        print(f"  {step:<16} n={s['count']:<5} p50 {s['p50_ms']:9.1f} ms  p95 {s['p95_ms']:9.1f} ms  "
+              f"p99 {s['p99_ms']:9.1f} ms")
+    for message, count in level["errors"].items():
+        print(f"  error x{count}: {message}")
+
+
+def _healthy(base_url):
+    try:
+        urllib.request.urlopen(base_url + '/_stcore/health', timeout=1)
+    except OSError:
+        return False
+    return True
+
+
+def start_server(script, port, llm_url, llm_cache):
+    base_url = f"http://127.0.0.1:{port}"
+    if _healthy(base_url):
+        raise RuntimeError(f"Something is already serving on port {port}")
+    env = dict(os.environ, SFIE_LLM_URL=llm_url, SFIE_LLM_CACHE='1' if llm_cache else '0')
+    # XSRF protection is off so the headless client can PUT uploads without a browser cookie
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', script, '--server.headless', 'true',
+         '--server.port', str(port), '--server.enableXsrfProtection', 'false',
+         '--browser.gatherUsageStats', 'false'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"streamlit exited with status {proc.returncode}")
+        if _healthy(base_url):
+            return proc, base_url
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("streamlit did not become healthy within 60s")
+
+
+async def run(args, base_url, server_pid, samples):
+    selectbox_by_index = await detect_selectbox_encoding(base_url, args.timeout)
+    levels = []
+    for sessions in args.sessions:
+        level = await run_level(args, base_url, server_pid, sessions, samples, selectbox_by_index)
+        report(level)
+        levels.append(level)
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, nargs='*', default=[1, 4, 16], help="concurrency levels")
+    parser.add_argument('--flows', type=int, default=2, help="sessions run back to back per concurrent slot")
+    parser.add_argument('--only', nargs='*', default=list(FLOWS), choices=FLOWS)
+    parser.add_argument('--script', default=os.path.join(ROOT, 'app.py'))
+    parser.add_argument('--port', type=int, default=8599)
+    parser.add_argument('--timeout', type=float, default=120, help="per-rerun timeout in seconds")
+    parser.add_argument('--llm-latency', default='lognormal:0.5,0.4', help="mock LLM time to first token")
+    parser.add_argument('--llm-token-rate', type=float, default=200)
+    parser.add_argument('--llm-tokens', type=int, default=200)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help="fraction of mock LLM requests failing")
+    parser.add_argument('--llm-cache', action='store_true', help="keep the app's LLM response cache on")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        parser.error("the sessions need websockets: pip install -r benchmarks/requirements.txt")
+
+    from mock_llm_server import MockConfig, serve_in_thread
+
+    llm = serve_in_thread(MockConfig(args.llm_latency, args.llm_token_rate, args.llm_tokens, args.llm_error_rate))
+    proc, base_url = start_server(args.script, args.port, llm.url, args.llm_cache)
+    samples = sorted(glob.glob(os.path.join(ROOT, '*.jpg')))
+    try:
+        levels = asyncio.run(run(args, base_url, proc.pid, samples))
+    finally:
+        proc.terminate()
+        proc.wait()
+        llm.shutdown()
+        llm.server_close()
+    print(f"\nMock LLM: {llm.stats.snapshot()}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"llm_server": llm.stats.snapshot(), "levels": levels}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import os
+import pickle
+import threading
+
+# Compiled form of recommendation.xlsx, rebuilt whenever the xlsx mtime changes
+CACHE_SUFFIX = '.catalog.pkl'
+
+_catalogs = {}
+_lock = threading.Lock()
+
+
+class Catalog:
+    def __init__(self, source_mtime, classes, products):
+        self.source_mtime = source_mtime
+        self.classes = classes
+        # class -> list of product rows as plain dicts
+        self.products = products
+
+    def for_class(self, c):
+        return self.products.get(c, [])
+
+
+# Compiled-catalog pickle kept next to the spreadsheet
+def cache_file(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '.' + os.path.splitext(name)[0] + CACHE_SUFFIX)
+
+
+# Convert the spreadsheet into a dict-of-lists keyed by class (the only place pandas is used)
+def compile_catalog(path, mtime):
+    import pandas as pd
+
+    df = pd.read_excel(path)
+    classes = list(df['class'].unique())
+    products = {c: [] for c in classes}
+    for row in df.to_dict('records'):
+        products[row['class']].append(row)
+    return Catalog(mtime, classes, products)
+
+
+# The pickled catalog, or None when it is missing, unreadable or older than the spreadsheet
+def read_cache(cache_path, mtime):
+    try:
+        with open(cache_path, 'rb') as f:
+            catalog = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+    if not isinstance(catalog, Catalog) or catalog.source_mtime != mtime:
+        return None
+    return catalog
+
+
+def write_cache(cache_path, catalog):
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(catalog, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # A read-only checkout still works, it just recompiles per process
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Return the catalog for `path`, served from memory, then the on-disk cache, then the xlsx
+def get_catalog(path='recommendation.xlsx'):
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+
+    catalog = _catalogs.get(path)
+    if catalog is not None and catalog.source_mtime == mtime:
+        return catalog
+
+    with _lock:
+        catalog = _catalogs.get(path)
+        if catalog is not None and catalog.source_mtime == mtime:
+            return catalog
+
+        cache_path = cache_file(path)
+        catalog = read_cache(cache_path, mtime)
+        if catalog is None:
+            catalog = compile_catalog(path, mtime)
+            write_cache(cache_path, catalog)
+        _catalogs[path] = catalog
+        return catalog
@@ -0,0 +1,200 @@
+"""Evaluate one or more model artifacts on a labeled photo folder.
+
+    python evaluate.py labeled/
+    python evaluate.py labeled/ --artifact fastai --artifact onnx-int8 --batch-size 64 --threads 4
+
+The folder holds one sub-directory per class, named as in learn.dls.vocab. Each --artifact
+is BACKEND[:PATH] (see backends.py): PATH is the .pkl for fastai/direct and the export
+directory for the exported runtimes. Photos are decoded once, like uploads in app.py, and
+every batch goes through each artifact in turn, so several artifacts are compared in one pass.
+Reports top-1/top-3 accuracy, per-class recall, the confusion matrix, images/sec and memory.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from backends import BACKEND, EXPORT_DIR, make_backend
+from batch_score import IMAGE_EXTENSIONS, Predictor, batches, iter_decoded
+from face_regions import FACE_CROP, predict_regions_many
+from model_registry import model_metrics, peak_rss_mb, rss_mb
+from inference import top_k
+
+
+# (path, class) for every photo under a class-per-directory folder
+def list_labeled(root):
+    items = []
+    for label in sorted(os.listdir(root)):
+        directory = os.path.join(root, label)
+        if not os.path.isdir(directory):
+            continue
+        for dirpath, _, files in os.walk(directory):
+            items.extend((os.path.join(dirpath, f), label) for f in sorted(files)
+                         if f.lower().endswith(IMAGE_EXTENSIONS))
+    return items
+
+
+def parse_artifact(spec, default_model):
+    name, _, path = spec.partition(':')
+    if name in ('fastai', 'direct'):
+        return make_backend(name, model_path=path or default_model)
+    return make_backend(name, export_dir=path or EXPORT_DIR)
+
+
+class Evaluation:
+    def __init__(self, name, classes):
+        self.name = name
+        self.classes = classes
+        self.confusion = {actual: {c: 0 for c in classes} for actual in classes}
+        self.total = 0
+        self.top1 = 0
+        self.top3 = 0
+        self.seconds = 0.0
+        self.predictions = []
+
+    def add(self, label, result):
+        ranked = [c for c, _ in top_k(result, 3)]
+        self.total += 1
+        self.top1 += ranked[0] == label
+        self.top3 += label in ranked
+        # Predicted classes missing from the folder still get a column
+        self.confusion[label][ranked[0]] = self.confusion[label].get(ranked[0], 0) + 1
+        self.predictions.append(ranked[0])
+
+    def recall(self):
+        return {c: (row[c] / sum(row.values()) if sum(row.values()) else None) for c, row in self.confusion.items()}
+
+    def summary(self):
+        return {
+            "images": self.total,
+            "top1": self.top1 / self.total if self.total else None,
+            "top3": self.top3 / self.total if self.total else None,
+            "recall": self.recall(),
+            "confusion": self.confusion,
+            "inference_seconds": self.seconds,
+            "images_per_s": self.total / self.seconds if self.seconds else None,
+        }
+
+
+def evaluate(items, backends, names, classes, batch_size=32, workers=4, face_crop=FACE_CROP):
+    evaluations = [Evaluation(name, classes) for name in names]
+    predictors = [Predictor(backend) for backend in backends]
+    labels = dict(items)
+    skipped = []
+    start = time.perf_counter()
+    for batch in batches(iter_decoded([p for p, _ in items], workers, max(128, batch_size)), batch_size):
+        ok = [(path, img) for path, img, error in batch if error is None]
+        skipped.extend((path, error) for path, _, error in batch if error is not None)
+        if not ok:
+            continue
+        imgs = [img for _, img in ok]
+        for evaluation, predictor in zip(evaluations, predictors):
+            t = time.perf_counter()
+            results = predict_regions_many(predictor, imgs, face_crop)
+            evaluation.seconds += time.perf_counter() - t
+            for (path, _), result in zip(ok, results):
+                evaluation.add(labels[path], result.result)
+    return evaluations, skipped, time.perf_counter() - start
+
+
+def _format_confusion(evaluation):
+    rows = evaluation.classes
+    columns = rows + sorted({c for row in evaluation.confusion.values() for c in row} - set(rows))
+    width = max(len(c) for c in rows)
+    lines = [' ' * (width + 2) + ' '.join(f"{c[:6]:>6}" for c in columns)]
+    for actual in rows:
+        row = evaluation.confusion[actual]
+        lines.append(f"{actual:>{width}}  " + ' '.join(f"{row.get(c, 0):>6}" for c in columns))
+    return '\n'.join(lines)
+
+
+def _pct(value):
+    return f"{value:.2%}" if value is not None else '-'
+
+
+def report(evaluations, skipped, elapsed):
+    names = [e.name for e in evaluations]
+    width = max(12, *(len(n) for n in names))
+    print(f"\n{'':<24}" + ''.join(f"{n:>{width + 2}}" for n in names))
+    rows = [
+        ("top-1 accuracy", lambda s: _pct(s['top1'])),
+        ("top-3 accuracy", lambda s: _pct(s['top3'])),
+        ("images/sec", lambda s: f"{s['images_per_s']:.1f}" if s['images_per_s'] else '-'),
+    ]
+    summaries = [e.summary() for e in evaluations]
+    for title, fmt in rows:
+        print(f"{title:<24}" + ''.join(f"{fmt(s):>{width + 2}}" for s in summaries))
+    for c in evaluations[0].classes:
+        print(f"{'recall ' + c:<24}" + ''.join(
+            f"{_pct(s['recall'][c]):>{width + 2}}" for s in summaries))
+    base = evaluations[0].predictions
+    for e in evaluations[1:]:
+        if base:
+            agree = sum(a == b for a, b in zip(base, e.predictions))
+            print(f"top-1 agreement {evaluations[0].name} vs {e.name}: {agree / len(base):.2%}")
+    for e in evaluations:
+        print(f"\nConfusion matrix, {e.name} (rows: actual, columns: predicted)\n{_format_confusion(e)}")
+    print(f"\n{evaluations[0].total} photos in {elapsed:.1f}s, {len(skipped)} unreadable; "
+          f"peak RSS {peak_rss_mb() or 0:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('folder', help="one sub-directory of photos per class")
+    parser.add_argument('--artifact', action='append', help="BACKEND[:PATH], repeat to compare (default: "
+                                                            "SFIE_MODEL_BACKEND)")
+    parser.add_argument('--model', default='export.pkl', help="Learner used when an artifact gives no path")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help="decoding threads")
+    parser.add_argument('--threads', type=int, help="torch intra-op threads (torch.set_num_threads)")
+    parser.add_argument('--face-crop', default=FACE_CROP, choices=['off', 'face', 'zones'])
+    parser.add_argument('--json', help="write the metrics to this file")
+    args = parser.parse_args()
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+
+    rss_before = rss_mb()
+    specs = args.artifact or [BACKEND]
+    backends = [parse_artifact(spec, args.model) for spec in specs]
+    # version() loads every model now, so load memory is measured apart from scoring
+    for backend in backends:
+        backend.version()
+    rss_loaded = rss_mb()
+
+    items = list_labeled(args.folder)
+    classes = sorted({label for _, label in items})
+    if not items:
+        parser.error(f"No photos found under {args.folder}")
+    # A misnamed folder would otherwise just score 0% recall
+    for spec, backend in zip(specs, backends):
+        vocab = backend.vocab()
+        unknown = [c for c in classes if c not in vocab]
+        if unknown:
+            parser.error(f"{', '.join(unknown)} under {args.folder} not among the classes of {spec}: "
+                         f"{', '.join(vocab)}")
+    print(f"{len(items)} photos in {len(classes)} classes, artifacts: {', '.join(specs)}",
+          file=sys.stderr)
+
+    evaluations, skipped, elapsed = evaluate(items, backends, specs, classes, args.batch_size, args.workers,
+                                             args.face_crop)
+    report(evaluations, skipped, elapsed)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                "folder": args.folder,
+                "artifacts": {e.name: e.summary() for e in evaluations},
+                "skipped": skipped,
+                "seconds": elapsed,
+                "models_rss_mb": rss_loaded - rss_before if rss_before is not None and rss_loaded is not None
+                else None,
+                "model_loads": model_metrics(),
+                "peak_rss_mb": peak_rss_mb(),
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""Export export.pkl to CPU-friendly TorchScript/ONNX graphs and check they agree with the Learner.
+
+    python export_model.py                       # TorchScript fp32 + dynamic int8 into ./export
+    python export_model.py --onnx                # also ONNX (+ int8 if onnxruntime is installed)
+    python export_model.py --check-only          # re-run the accuracy check on existing artifacts
+
+Every exported graph takes a uint8 NCHW batch at the model's input size and returns
+softmax probabilities; resize/crop happen in preprocess.py using the stats saved in
+preprocess.json. Select one at runtime with SFIE_MODEL_BACKEND (see backends.py).
+
+The check also covers the "direct" backend (the Learner's model fed by the vectorized
+preprocessing) and compares that preprocessing with fastai's own input tensors.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import torch
+from torch import nn
+
+import preprocess
+from backends import ARTIFACTS, SPEC_FILE, DirectBackend, make_backend
+from model_registry import get_learner
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_IMAGES = [os.path.join(ROOT, f) for f in ('oily_skin.jpg', 'harmonal_acne.jpg', 'forehead_wrinkles.jpg')]
+
+
+# IntToFloatTensor + Normalize + model + softmax, so the graph is the whole of learn.predict after resizing
+class ExportedModel(nn.Module):
+    def __init__(self, model, mean, std):
+        super().__init__()
+        self.model = model
+        self.register_buffer('mean', torch.tensor(mean, dtype=torch.float32).view(1, -1, 1, 1))
+        self.register_buffer('std', torch.tensor(std, dtype=torch.float32).view(1, -1, 1, 1))
+
+    def forward(self, images):
+        x = (images.float() / 255. - self.mean) / self.std
+        return torch.softmax(self.model(x), dim=1)
+
+
+def _trace(module, example):
+    with torch.no_grad():
+        traced = torch.jit.trace(module, example)
+    return torch.jit.freeze(traced.eval())
+
+
+def export(learn, out_dir, example, onnx=False):
+    spec = preprocess.preprocess_spec(learn)
+    preprocess.save_spec(spec, os.path.join(out_dir, SPEC_FILE))
+
+    wrapper = ExportedModel(learn.model.eval().cpu(), spec["mean"], spec["std"]).eval()
+    written = []
+
+    path = os.path.join(out_dir, ARTIFACTS['torchscript'])
+    torch.jit.save(torch.jit.optimize_for_inference(_trace(wrapper, example)), path)
+    written.append('torchscript')
+
+    # Dynamic quantization only rewrites nn.Linear (the classifier head); the conv body stays fp32
+    quantized = torch.ao.quantization.quantize_dynamic(wrapper, {nn.Linear}, dtype=torch.qint8)
+    path = os.path.join(out_dir, ARTIFACTS['torchscript-int8'])
+    torch.jit.save(_trace(quantized, example), path)
+    written.append('torchscript-int8')
+
+    if onnx:
+        path = os.path.join(out_dir, ARTIFACTS['onnx'])
+        torch.onnx.export(wrapper, example, path, input_names=['images'], output_names=['probs'],
+                          dynamic_axes={'images': {0: 'batch'}, 'probs': {0: 'batch'}}, opset_version=17)
+        written.append('onnx')
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+        except ImportError:
+            print("onnxruntime not installed, skipping the int8 ONNX model")
+        else:
+            quantize_dynamic(path, os.path.join(out_dir, ARTIFACTS['onnx-int8']), weight_type=QuantType.QInt8)
+            written.append('onnx-int8')
+    return written
+
+
+# Largest difference between fastai's normalized input batch and preprocess.to_normalized_batch
+def check_preprocessing(learn, images):
+    from PIL import Image
+
+    imgs = [Image.open(f).convert('RGB') for f in images]
+    dl = learn.dls.test_dl(imgs, bs=len(imgs), num_workers=0)
+    (expected,) = dl.one_batch()
+    ours = preprocess.to_normalized_batch(imgs, preprocess.preprocess_spec(learn))
+    return float((expected.cpu().float() - ours).abs().max())
+
+
+# Compare every backend against learn.predict on the same images; returns rows of metrics
+def check_accuracy(learn, backends, images):
+    from PIL import Image
+
+    imgs = [Image.open(f).convert('RGB') for f in images]
+    vocab = list(learn.dls.vocab)
+    reference = []
+    start = time.perf_counter()
+    for img in imgs:
+        _, _, probs = learn.predict(img)
+        reference.append([float(p) for p in probs])
+    rows = [{"backend": "fastai", "top1_agreement": 1.0, "max_abs_delta": 0.0,
+             "ms_per_image": (time.perf_counter() - start) * 1000 / len(imgs)}]
+
+    for backend in backends:
+        backend.predict_batch(imgs[:1])  # warm-up
+        start = time.perf_counter()
+        results = backend.predict_batch(imgs)
+        elapsed = time.perf_counter() - start
+        agree, delta = 0, 0.0
+        for ref, result in zip(reference, results):
+            probs = [result[label] for label in vocab]
+            agree += probs.index(max(probs)) == ref.index(max(ref))
+            delta = max(delta, max(abs(a - b) for a, b in zip(probs, ref)))
+        rows.append({"backend": backend.name, "top1_agreement": agree / len(imgs), "max_abs_delta": delta,
+                     "ms_per_image": elapsed * 1000 / len(imgs)})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', default='export.pkl')
+    parser.add_argument('--out', default='export')
+    parser.add_argument('--onnx', action='store_true', help="also export ONNX graphs")
+    parser.add_argument('--check-only', action='store_true', help="skip exporting, only check existing artifacts")
+    parser.add_argument('--images', nargs='*', help="images for the accuracy check (default: bundled samples)")
+    parser.add_argument('--max-delta', type=float, default=0.05,
+                        help="fail if any class probability differs from the Learner by more than this")
+    parser.add_argument('--max-input-delta', type=float, default=0.05,
+                        help="fail if the vectorized preprocessing differs from fastai's by more than this "
+                             "(normalized units, about 1/58 per 8-bit intensity level)")
+    args = parser.parse_args()
+
+    images = [f for pattern in args.images for f in glob.glob(pattern)] if args.images else SAMPLE_IMAGES
+    learn = get_learner(args.model)
+
+    if args.check_only:
+        names = [n for n, f in ARTIFACTS.items() if os.path.exists(os.path.join(args.out, f))]
+    else:
+        os.makedirs(args.out, exist_ok=True)
+        from PIL import Image
+        spec = preprocess.preprocess_spec(learn)
+        example = preprocess.to_batch([Image.open(f) for f in images[:2]], spec)
+        names = export(learn, args.out, example, onnx=args.onnx)
+
+    input_delta = check_preprocessing(learn, images)
+    print(f"Vectorized preprocessing vs fastai pipeline: max |delta| {input_delta:.5f}")
+
+    backends = [DirectBackend(args.model)] + [make_backend(name, args.model, args.out) for name in names]
+    rows = check_accuracy(learn, backends, images)
+
+    print(f"{'backend':<18}{'top-1 agree':>12}{'max |delta|':>13}{'ms/image':>10}")
+    failed = False
+    for row in rows:
+        print(f"{row['backend']:<18}{row['top1_agreement']:>12.0%}{row['max_abs_delta']:>13.4f}"
+              f"{row['ms_per_image']:>10.1f}")
+        failed |= row['max_abs_delta'] > args.max_delta or row['top1_agreement'] < 1.0
+    failed |= input_delta > args.max_input_delta
+    if failed:
+        print(f"Exported model disagrees with the Learner (max delta {args.max_delta})", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
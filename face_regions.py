@@ -0,0 +1,146 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+from inference import fuse_results
+from metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+# off: classify the whole photo; face: crop to the detected face; zones: forehead/T-zone/cheek patches
+FACE_CROP = os.environ.get('SFIE_FACE_CROP', 'off')
+# Detection runs on a grayscale copy no larger than this, then the box is scaled back
+DETECT_MAX_SIDE = int(os.environ.get('SFIE_DETECT_MAX_SIDE', 400))
+FACE_MARGIN = 0.15
+MIN_PATCH_SIDE = 16
+
+# Patches as (left, top, right, bottom) fractions of the face box
+ZONES = {
+    "forehead": (0.20, -0.05, 0.80, 0.25),
+    "t_zone": (0.35, 0.25, 0.65, 0.75),
+    "left_cheek": (0.10, 0.50, 0.40, 0.80),
+    "right_cheek": (0.60, 0.50, 0.90, 0.80),
+}
+
+_detector = None
+_detector_lock = threading.Lock()
+_timings = collections.deque(maxlen=1000)
+_timings_lock = threading.Lock()
+
+
+class RegionResult:
+    def __init__(self, result, regions, detect_seconds, crop_seconds, predict_seconds, tiers=None):
+        self.result = result
+        self.regions = regions
+        self.detect_seconds = detect_seconds
+        self.crop_seconds = crop_seconds
+        self.predict_seconds = predict_seconds
+        # Per patch, the cascade tier that answered ('fast' or 'full'); None without a cascade
+        # and for patches answered from the prediction cache
+        self.tiers = tiers or [None] * len(regions)
+
+
+# OpenCV's bundled Haar cascade: CPU-only, a few ms per photo.
+# None when opencv-python(-headless) 4.x isn't installed (5.x no longer ships the cascades).
+def _get_detector():
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                try:
+                    import cv2
+                    _detector = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+                except (ImportError, AttributeError):
+                    logger.warning("OpenCV 4.x with Haar cascades is not installed, face cropping is disabled")
+                    _detector = False
+    return _detector or None
+
+
+# Largest face in `img` as (x, y, w, h) in image pixels, or None
+def detect_face(img):
+    detector = _get_detector()
+    if detector is None:
+        return None
+    import numpy as np
+
+    scale = min(1.0, DETECT_MAX_SIDE / max(img.size))
+    small = img.convert('L')
+    if scale < 1:
+        small = small.resize((round(img.size[0] * scale), round(img.size[1] * scale)))
+    min_side = max(24, int(min(small.size) * 0.2))
+    faces = detector.detectMultiScale(np.asarray(small), scaleFactor=1.1, minNeighbors=5,
+                                      minSize=(min_side, min_side))
+    if len(faces) == 0:
+        return None
+    x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+    return tuple(int(round(v / scale)) for v in (x, y, w, h))
+
+
+def _clip(box, size):
+    left, top, right, bottom = box
+    return max(0, left), max(0, top), min(size[0], right), min(size[1], bottom)
+
+
+# Patches to classify for one photo; the whole photo when no face is found or cropping is off
+def crop_regions(img, face, mode=FACE_CROP):
+    if mode == 'off' or face is None:
+        return {"image": img}
+    x, y, w, h = face
+    if mode == 'face':
+        box = (x - w * FACE_MARGIN, y - h * FACE_MARGIN, x + w * (1 + FACE_MARGIN), y + h * (1 + FACE_MARGIN))
+        return {"face": img.crop(_clip(tuple(map(round, box)), img.size))}
+    if mode != 'zones':
+        raise ValueError(f"Unknown face crop mode: {mode}")
+    patches = {}
+    for name, (l, t, r, b) in ZONES.items():
+        left, top, right, bottom = _clip((round(x + l * w), round(y + t * h), round(x + r * w), round(y + b * h)),
+                                         img.size)
+        # Zones pushed off the edge of the photo are dropped rather than classified as slivers
+        if right - left >= MIN_PATCH_SIDE and bottom - top >= MIN_PATCH_SIDE:
+            patches[name] = img.crop((left, top, right, bottom))
+    return patches or {"image": img}
+
+
+# Detect, crop and classify several photos; every patch of every photo goes to the server together,
+# so they share one batch, and each photo's patches are averaged into one result
+def predict_regions_many(server, imgs, mode=FACE_CROP):
+    start = time.perf_counter()
+    faces = [detect_face(img) if mode != 'off' else None for img in imgs]
+    detected = time.perf_counter()
+    regions = [crop_regions(img, face, mode) for img, face in zip(imgs, faces)]
+    cropped = time.perf_counter()
+    patches = [patch for r in regions for patch in r.values()]
+    results = server.predict_many(patches)
+    predicted = time.perf_counter()
+
+    per_image = len(imgs) or 1
+    detect_seconds, crop_seconds = (detected - start) / per_image, (cropped - detected) / per_image
+    predict_seconds = (predicted - cropped) / per_image
+    with _timings_lock:
+        _timings.append((detect_seconds, crop_seconds, predict_seconds))
+
+    out, i = [], 0
+    for r in regions:
+        patch_results = results[i:i + len(r)]
+        i += len(r)
+        out.append(RegionResult(fuse_results(patch_results), list(r), detect_seconds, crop_seconds,
+                                predict_seconds, [getattr(p, 'tier', None) for p in patch_results]))
+    return out
+
+
+def predict_regions(server, img, mode=FACE_CROP):
+    return predict_regions_many(server, [img], mode)[0]
+
+
+# Per-photo detection, crop and prediction time, so the net effect of the pre-stage is visible
+def region_metrics():
+    with _timings_lock:
+        samples = list(_timings)
+    metrics = {"photos": len(samples)}
+    for i, stage in enumerate(("detect", "crop", "predict")):
+        values = sorted(s[i] for s in samples)
+        metrics[f"{stage}_p50_s"] = percentile(values, 0.50)
+        metrics[f"{stage}_p95_s"] = percentile(values, 0.95)
+    return metrics
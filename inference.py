@@ -0,0 +1,28 @@
+# Run one forward pass over all images and return a {label: prob} dict per image
+def predict_batch(learn, imgs):
+    from fastai.vision.core import PILImage
+
+    if not imgs:
+        return []
+    labels = learn.dls.vocab
+    items = [PILImage.create(img) for img in imgs]
+    dl = learn.dls.test_dl(items, bs=len(items), num_workers=0)
+    probs, _ = learn.get_preds(dl=dl)
+    return [{labels[i]: float(row[i]) for i in range(len(labels))} for row in probs]
+
+
+# Combine per-photo results into one score per label ("mean" or "max" over photos)
+def fuse_results(results, how="mean"):
+    if not results:
+        return {}
+    if how not in ("mean", "max"):
+        raise ValueError(f"Unknown fusion method: {how}")
+    fused = {}
+    for label in results[0]:
+        scores = [r[label] for r in results]
+        fused[label] = max(scores) if how == "max" else sum(scores) / len(scores)
+    return fused
+
+
+def top_k(results, k=3):
+    return sorted(results.items(), key=lambda x: x[1], reverse=True)[:k]
@@ -0,0 +1,379 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import preprocess
+from backends import SPEC_FILE, scaled_spec, to_results
+from inference_server import ServerBusy
+from model_registry import file_sha256
+
+logger = logging.getLogger(__name__)
+
+# Worker processes serving predict() with SFIE_MODEL_BACKEND=direct; 0 keeps inference in the Streamlit process
+WORKERS = int(os.environ.get('SFIE_INFERENCE_WORKERS', 0))
+# torch intra-op threads per worker (0: the CPUs split evenly between workers)
+WORKER_THREADS = int(os.environ.get('SFIE_WORKER_THREADS', 0))
+# Where the weights are unpacked once per model version, to be memory-mapped by every worker
+SHARED_WEIGHTS_DIR = os.environ.get('SFIE_SHARED_WEIGHTS_DIR', os.path.join(tempfile.gettempdir(), 'sfie-weights'))
+# Seconds a batch may wait for a worker before the request fails
+WORKER_TIMEOUT = float(os.environ.get('SFIE_WORKER_TIMEOUT', 60))
+
+MODEL_FILE = 'model.pt'
+WEIGHTS_FILE = 'weights.pt'
+# Seconds between checks for crashed workers
+CHECK_SECONDS = 1.0
+
+# Workers start from a fresh interpreter: forking the Streamlit server's threads is not safe, and the
+# weights are shared through the page cache of the memory-mapped file rather than copy-on-write pages
+_context = multiprocessing.get_context('spawn')
+
+
+# A batch the pool could not serve (timed out, worker crashed or failed, pool closed). It is a
+# ServerBusy, so app.py shows its "try again" message instead of a traceback.
+class WorkerUnavailable(ServerBusy):
+    pass
+
+
+def default_threads(workers):
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+# Split the Learner into its module with the tensors left out (model.pt), a plain state dict that
+# can be memory-mapped (weights.pt) and the preprocessing spec; runs in a throwaway process, so
+# the process serving the app never unpickles the Learner itself
+def _unpack(model_path, out_dir):
+    import torch
+    from model_registry import unpickle_learner
+
+    learn = unpickle_learner(model_path)
+    model = learn.model.eval().cpu()
+    tmp_dir = tempfile.mkdtemp(prefix='.unpack-', dir=os.path.dirname(out_dir))
+    try:
+        preprocess.save_spec(preprocess.preprocess_spec(learn), os.path.join(tmp_dir, SPEC_FILE))
+        torch.save(model.state_dict(), os.path.join(tmp_dir, WEIGHTS_FILE))
+        torch.save({"model": model.to('meta'), "loss_func": learn.loss_func}, os.path.join(tmp_dir, MODEL_FILE))
+        os.replace(tmp_dir, out_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+# Directory holding the unpacked weights of the model at `model_path`, unpacking them on first use
+def shared_weights(model_path, sha256, weights_dir=SHARED_WEIGHTS_DIR):
+    out_dir = os.path.join(weights_dir, sha256[:16])
+    if os.path.exists(os.path.join(out_dir, MODEL_FILE)):
+        return out_dir
+    os.makedirs(weights_dir, exist_ok=True)
+    process = _context.Process(target=_unpack, args=(os.path.abspath(model_path), out_dir),
+                               name='sfie-unpack-weights')
+    process.start()
+    process.join()
+    if process.exitcode != 0 and not os.path.exists(os.path.join(out_dir, MODEL_FILE)):
+        raise RuntimeError(f"Unpacking the weights of {model_path} failed (exit code {process.exitcode})")
+    return out_dir
+
+
+# The module with its parameters pointing into the memory-mapped weights file (needs torch >= 2.1).
+# Inference never writes to them, so every worker maps the same physical pages.
+def _load_shared(weights_dir):
+    import torch
+
+    saved = torch.load(os.path.join(weights_dir, MODEL_FILE), map_location='cpu', weights_only=False)
+    state = torch.load(os.path.join(weights_dir, WEIGHTS_FILE), map_location='cpu', mmap=True, weights_only=True)
+    model = saved["model"]
+    model.load_state_dict(state, assign=True)
+    activation = getattr(saved["loss_func"], 'activation', lambda x: torch.softmax(x, dim=1))
+    spec = preprocess.load_spec(os.path.join(weights_dir, SPEC_FILE))
+    return model.eval(), activation, spec
+
+
+def _worker(index, weights_dir, threads, tasks, results):
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        model, activation, spec = _load_shared(weights_dir)
+    except Exception as e:
+        results.put(('failed', index, f"{type(e).__name__}: {e}"))
+        return
+    results.put(('ready', index, os.getpid()))
+    # Input side -> spec; a size is set for the reduced-size cascade tier
+    specs = {None: spec}
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, imgs, size = task
+        results.put(('started', index, task_id))
+        try:
+            if size not in specs:
+                specs[size] = scaled_spec(spec, size)
+            with torch.inference_mode():
+                probs = activation(model(preprocess.to_normalized_batch(imgs, specs[size])))
+            results.put(('done', task_id, to_results(spec["vocab"], probs.tolist())))
+        except Exception as e:
+            results.put(('error', task_id, f"{type(e).__name__}: {e}"))
+
+
+# Resident memory of a process split into private pages and pages backed by files (the shared weights)
+def process_memory(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return {key: int(fields[key].split()[0]) / 1024 for key in ('RssAnon', 'RssFile') if key in fields}
+    except (OSError, ValueError):
+        return None
+
+
+# One set of worker processes serving one model version
+class WorkerPool:
+    def __init__(self, weights_dir, workers, threads, ready_timeout=WORKER_TIMEOUT):
+        self.weights_dir = weights_dir
+        self.threads = threads
+        self._tasks = _context.Queue()
+        self._results = _context.Queue()
+        self._ids = itertools.count()
+        self._pending = {}
+        # Task each worker is running, so a crash fails that request instead of leaving it hanging
+        self._running = {}
+        self._pids = {}
+        self._given_up = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._failed = None
+        self.tasks = 0
+        self.restarts = 0
+        self._ready = threading.Semaphore(0)
+        self._processes = [self._spawn(i) for i in range(workers)]
+        self._reader = threading.Thread(target=self._read, name='sfie-pool-results', daemon=True)
+        self._reader.start()
+        for _ in range(workers):
+            if not self._ready.acquire(timeout=ready_timeout):
+                self.close()
+                raise RuntimeError(f"Inference workers not ready after {ready_timeout:g}s")
+        if self._failed:
+            self.close()
+            raise RuntimeError(f"Inference worker failed to load the model: {self._failed}")
+
+    def _spawn(self, index):
+        process = _context.Process(target=_worker, args=(index, self.weights_dir, self.threads, self._tasks,
+                                                         self._results), name=f'sfie-inference-{index}', daemon=True)
+        process.start()
+        return process
+
+    def submit(self, imgs, size=None):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise WorkerUnavailable("Worker pool is closed")
+            task_id = next(self._ids)
+            self._pending[task_id] = future
+            self.tasks += 1
+        self._tasks.put((task_id, imgs, size))
+        return task_id, future
+
+    # Submit and wait; a batch that times out is forgotten, and its late result dropped
+    def run(self, imgs, timeout=None, size=None):
+        task_id, future = self.submit(imgs, size)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._pending.pop(task_id, None)
+            raise WorkerUnavailable(f"No inference worker answered within {timeout:g}s")
+
+    def _resolve(self, task_id, result=None, error=None):
+        with self._lock:
+            future = self._pending.pop(task_id, None)
+            for index, running in list(self._running.items()):
+                if running == task_id:
+                    del self._running[index]
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(WorkerUnavailable(error))
+        else:
+            future.set_result(result)
+
+    def _read(self):
+        next_check = time.monotonic() + CHECK_SECONDS
+        while True:
+            try:
+                kind, key, value = self._results.get(timeout=max(0.0, next_check - time.monotonic()))
+            except queue.Empty:
+                if self._closed and not self._pending:
+                    return
+                kind = None
+            except (EOFError, OSError):
+                return
+            # On a timer rather than only when no results come: under load the other workers keep the queue
+            # busy, and a crashed worker would go unnoticed
+            if time.monotonic() >= next_check:
+                self._check_workers()
+                next_check = time.monotonic() + CHECK_SECONDS
+            if kind is None:
+                continue
+            if kind == 'ready':
+                self._pids[key] = value
+                self._ready.release()
+            elif kind == 'failed':
+                self._failed = value
+                self._ready.release()
+            elif kind == 'started':
+                with self._lock:
+                    self._running[key] = value
+            elif kind == 'done':
+                self._resolve(key, result=value)
+            else:
+                self._resolve(key, error=value)
+
+    # Fail the batch a dead worker was running and start a replacement; a worker that dies before it
+    # has loaded the model is not restarted, since its replacement would only do the same
+    def _check_workers(self):
+        for index, process in enumerate(self._processes):
+            if process.is_alive() or self._closed or index in self._given_up:
+                continue
+            if index not in self._pids:
+                logger.warning("Inference worker %s exited with code %s while loading the model", index,
+                               process.exitcode)
+                self._given_up.add(index)
+                self._failed = f"worker {index} exited with code {process.exitcode}"
+                self._ready.release()
+                continue
+            with self._lock:
+                task_id = self._running.get(index)
+            logger.warning("Inference worker %s exited with code %s, restarting", index, process.exitcode)
+            if task_id is not None:
+                self._resolve(task_id, error=f"Inference worker exited with code {process.exitcode}")
+            self._pids.pop(index, None)
+            self.restarts += 1
+            self._processes[index] = self._spawn(index)
+
+    # Queued and running batches still finish; the workers exit once the queue is drained
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for _ in self._processes:
+            self._tasks.put(None)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        memory = {pid: process_memory(pid) for pid in self._pids.values()}
+        return {
+            "workers": len(self._processes),
+            "alive": sum(p.is_alive() for p in self._processes),
+            "threads_per_worker": self.threads,
+            "tasks": self.tasks,
+            "pending": pending,
+            "restarts": self.restarts,
+            "worker_rss_anon_mb": {pid: m.get('RssAnon') for pid, m in memory.items() if m},
+            "worker_rss_file_mb": {pid: m.get('RssFile') for pid, m in memory.items() if m},
+        }
+
+
+# Backend running the Learner's model in worker processes; a new model file starts a new pool and
+# the old one is closed once its queued batches are done
+class ProcessPoolBackend:
+    def __init__(self, model_path='export.pkl', workers=None, threads=None, weights_dir=SHARED_WEIGHTS_DIR,
+                 timeout=WORKER_TIMEOUT):
+        self.model_path = model_path
+        self.workers = workers or WORKERS or 1
+        self.threads = threads or WORKER_THREADS or default_threads(self.workers)
+        self.weights_dir = weights_dir
+        self.timeout = timeout
+        self.name = f'pool[{self.workers}x{self.threads}]'
+        # One batch per worker in flight: the inference server runs this many dispatch threads
+        self.concurrency = self.workers
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._sha256 = None
+        self._pool = None
+        self._current()
+
+    # Pool for the model file as it is now, replacing the running one when the file was rewritten.
+    # If the new file can't be served, the running pool keeps serving the previous one.
+    def _current(self):
+        try:
+            mtime = os.path.getmtime(self.model_path)
+        except OSError:
+            if self._pool is None:
+                raise
+            return self._pool, self._sha256
+        if self._pool is not None and mtime == self._mtime:
+            return self._pool, self._sha256
+        with self._lock:
+            if self._pool is not None and mtime == self._mtime:
+                return self._pool, self._sha256
+            sha256 = file_sha256(self.model_path)
+            if self._pool is None or sha256 != self._sha256:
+                start = time.perf_counter()
+                try:
+                    pool = WorkerPool(shared_weights(self.model_path, sha256, self.weights_dir), self.workers,
+                                      self.threads)
+                except (OSError, RuntimeError):
+                    if self._pool is None:
+                        raise
+                    logger.exception("Starting workers for the new %s failed, still serving the old one",
+                                     self.model_path)
+                    self._mtime = mtime
+                    return self._pool, self._sha256
+                logger.info("Started %s inference workers for %s in %.2fs", self.workers, self.model_path,
+                            time.perf_counter() - start)
+                old, self._pool, self._sha256 = self._pool, pool, sha256
+                if old is not None:
+                    old.close()
+            self._mtime = mtime
+            return self._pool, self._sha256
+
+    # Same weights and preprocessing as the 'direct' backend, so both share cached predictions
+    def version(self):
+        return f"direct:{self._current()[1]}"
+
+    def vocab(self):
+        return preprocess.load_spec(os.path.join(self._current()[0].weights_dir, SPEC_FILE))["vocab"]
+
+    def predict_batch(self, imgs, size=None):
+        if not imgs:
+            return []
+        pool, _ = self._current()
+        # Plain RGB images pickle cheaply; the worker builds the batch tensor itself
+        return pool.run(list(imgs), self.timeout, size)
+
+    # The same workers at a reduced input size, for the cascade's fast tier
+    def scaled(self, size):
+        return ScaledPoolBackend(self, size) if size else self
+
+    def stats(self):
+        return self._pool.stats() if self._pool is not None else None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+
+
+# 'direct@size' served by a pool's workers, like DirectBackend(size=...) but without a Learner in this process
+class ScaledPoolBackend:
+    def __init__(self, pool_backend, size):
+        self.pool_backend = pool_backend
+        self.size = size
+        self.name = f'direct@{size}'
+        self.concurrency = pool_backend.concurrency
+
+    def version(self):
+        return f"{self.name}:{self.pool_backend.version().split(':', 1)[1]}"
+
+    def vocab(self):
+        return self.pool_backend.vocab()
+
+    def predict_batch(self, imgs):
+        return self.pool_backend.predict_batch(imgs, self.size)
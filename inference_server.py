@@ -0,0 +1,155 @@
+import collections
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import percentile
+from prediction_cache import CACHE_ENABLED, PredictionCache, image_key
+
+# Batching knobs, overridable from the environment
+BATCH_WINDOW_MS = float(os.environ.get('SFIE_BATCH_WINDOW_MS', 10))
+MAX_BATCH = int(os.environ.get('SFIE_MAX_BATCH', 16))
+MAX_QUEUE = int(os.environ.get('SFIE_MAX_QUEUE', 64))
+SUBMIT_TIMEOUT = float(os.environ.get('SFIE_SUBMIT_TIMEOUT', 2))
+
+
+class ServerBusy(Exception):
+    pass
+
+
+class _Request:
+    def __init__(self, img):
+        self.img = img
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+# Worker thread that collects predict() calls from all sessions and runs them as one batch; backends
+# that run batches in parallel (a process pool) get one such thread per batch they can take at once
+class InferenceServer:
+    def __init__(self, model_path='export.pkl', backend=None, batch_window_ms=BATCH_WINDOW_MS,
+                 max_batch=MAX_BATCH, max_queue=MAX_QUEUE, submit_timeout=SUBMIT_TIMEOUT, stats_window=1000,
+                 cache=None):
+        if backend is None:
+            # Imported here so pages that never predict don't pull in PIL/numpy
+            from backends import get_backend
+            backend = get_backend(model_path=model_path)
+        self.model_path = model_path
+        self.backend = backend
+        self.cache = cache if cache is not None else PredictionCache() if CACHE_ENABLED else None
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.submit_timeout = submit_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._latencies = collections.deque(maxlen=stats_window)
+        self._batch_sizes = collections.deque(maxlen=stats_window)
+        self._rejected = 0
+        self._stats_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, name=f'sfie-inference-{i}', daemon=True)
+                         for i in range(getattr(backend, 'concurrency', 1))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, img):
+        request = _Request(img)
+        try:
+            self._queue.put(request, timeout=self.submit_timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            raise ServerBusy(f"Inference queue is full ({self._queue.maxsize} pending requests)")
+        return request.future
+
+    def predict(self, img, timeout=None):
+        return self.predict_many([img], timeout)[0]
+
+    # Cache hits are answered on the caller's thread; only misses are queued for the worker.
+    # use_cache=False always runs the model (warm-up) and leaves the cache untouched.
+    def predict_many(self, imgs, timeout=None, use_cache=True):
+        if self.cache is None or not use_cache:
+            futures = [self.submit(img) for img in imgs]
+            return [f.result(timeout) for f in futures]
+
+        version = self.backend.version()
+        keys = [image_key(img, version) for img in imgs]
+        results = [self.cache.get(key) for key in keys]
+        futures = {i: self.submit(img) for i, img in enumerate(imgs) if results[i] is None}
+        for i, future in futures.items():
+            results[i] = future.result(timeout)
+            self.cache.put(keys[i], results[i])
+        return results
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.backend.predict_batch([r.img for r in batch])
+            except Exception as e:
+                for r in batch:
+                    r.future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            for r, result in zip(batch, results):
+                r.future.set_result(result)
+            with self._stats_lock:
+                self._latencies.extend(done - r.submitted for r in batch)
+                self._batch_sizes.append(len(batch))
+
+    def stats(self):
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            batch_sizes = list(self._batch_sizes)
+            rejected = self._rejected
+
+        return {
+            "requests": len(latencies),
+            "rejected": rejected,
+            "queued": self._queue.qsize(),
+            "latency_p50_s": percentile(latencies, 0.50),
+            "latency_p95_s": percentile(latencies, 0.95),
+            "latency_p99_s": percentile(latencies, 0.99),
+            "mean_batch_size": sum(batch_sizes) / len(batch_sizes) if batch_sizes else None,
+            "backend": self.backend.name,
+            "backend_stats": self.backend.stats() if hasattr(self.backend, 'stats') else None,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+# Process-wide server per model file, shared by every Streamlit session
+def get_server(model_path='export.pkl'):
+    model_path = os.path.abspath(model_path)
+    server = _servers.get(model_path)
+    if server is None:
+        with _servers_lock:
+            server = _servers.get(model_path)
+            if server is None:
+                server = _servers[model_path] = InferenceServer(model_path)
+    return server
+
+
+# stats() of every server started in this process, by model file
+def server_stats():
+    with _servers_lock:
+        servers = dict(_servers)
+    return {path: server.stats() for path, server in servers.items()}
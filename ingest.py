@@ -0,0 +1,63 @@
+import io
+import os
+import time
+
+from PIL import Image, ImageOps
+
+# Upload limits and target sizes, overridable from the environment
+MAX_UPLOAD_BYTES = int(os.environ.get('SFIE_MAX_UPLOAD_BYTES', 25 * 2 ** 20))
+MAX_UPLOAD_PIXELS = int(os.environ.get('SFIE_MAX_UPLOAD_PIXELS', 60_000_000))
+# Longest side kept for the model; comfortably above the 256px the analyzer resizes to
+MODEL_MAX_SIDE = int(os.environ.get('SFIE_MODEL_MAX_SIDE', 512))
+DISPLAY_MAX_SIDE = int(os.environ.get('SFIE_DISPLAY_MAX_SIDE', 768))
+
+
+class UploadRejected(Exception):
+    pass
+
+
+class Upload:
+    def __init__(self, model_image, thumbnail, original_size, decoded_size, decode_seconds):
+        self.model_image = model_image
+        self.thumbnail = thumbnail
+        self.original_size = original_size
+        self.decoded_size = decoded_size
+        self.decode_seconds = decode_seconds
+
+
+# Decode an uploaded photo once, at close to the size we actually need, into a model image and a thumbnail
+def ingest_upload(uploaded_file, model_max_side=MODEL_MAX_SIDE, display_max_side=DISPLAY_MAX_SIDE):
+    start = time.perf_counter()
+    data = uploaded_file.getvalue() if hasattr(uploaded_file, 'getvalue') else uploaded_file.read()
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise UploadRejected(f"The photo is too large ({len(data) / 2 ** 20:.0f} MB, "
+                             f"limit {MAX_UPLOAD_BYTES / 2 ** 20:.0f} MB).")
+
+    try:
+        img = Image.open(io.BytesIO(data))
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise UploadRejected(f"The photo could not be read: {e}")
+
+    # Only the header has been read so far: reject huge images before any pixels are decoded
+    original_size = img.size
+    if original_size[0] * original_size[1] > MAX_UPLOAD_PIXELS:
+        raise UploadRejected(f"The photo is too large ({original_size[0]}x{original_size[1]} pixels).")
+
+    # JPEG: let libjpeg decode at 1/2, 1/4 or 1/8 scale, as long as the result stays above what we need
+    target = max(model_max_side, display_max_side)
+    scale = target / max(original_size)
+    if scale < 1:
+        img.draft('RGB', (round(original_size[0] * scale), round(original_size[1] * scale)))
+
+    try:
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('RGB')
+    except (OSError, SyntaxError) as e:
+        raise UploadRejected(f"The photo could not be decoded: {e}")
+    decoded_size = img.size
+
+    thumbnail = img.copy()
+    thumbnail.thumbnail((display_max_side, display_max_side), Image.BILINEAR)
+    model_image = img
+    model_image.thumbnail((model_max_side, model_max_side), Image.BILINEAR)
+    return Upload(model_image, thumbnail, original_size, decoded_size, time.perf_counter() - start)
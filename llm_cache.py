@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import llm_client
+from llm_client import LLMError
+
+# Cache settings, overridable from the environment
+CACHE_ENABLED = os.environ.get('SFIE_LLM_CACHE', '1') == '1'
+CACHE_PATH = os.environ.get('SFIE_LLM_CACHE_PATH', '.llm_cache.sqlite')
+CACHE_TTL = float(os.environ.get('SFIE_LLM_CACHE_TTL', 7 * 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get('SFIE_LLM_CACHE_MAX_ENTRIES', 10000))
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    return value
+
+
+# Canonical hash of the questionnaire answers plus everything that changes the model's output,
+# including the rendered prompt, so editing prompts.build_prompt never replays the old prompt's answers
+def cache_key(answers, prompt, url=None, params=None):
+    payload = {
+        "answers": _normalize(answers),
+        "prompt": hashlib.sha256(prompt.encode('utf-8')).hexdigest(),
+        "url": url or llm_client.LLM_URL,
+        "params": params or llm_client.DEFAULT_PARAMS,
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# SQLite-backed response cache with a TTL and least-recently-used eviction
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            overflow = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+# Hit/miss counters of the shared cache, or None while nothing has used it (nothing is opened here)
+def cache_stats():
+    return _cache.stats() if _cache is not None else None
+
+
+# get_response with the answers-keyed cache in front; failures are returned but never cached.
+# The API key is not part of the key and a hit makes no request, so a hit is served for any non-empty
+# key without it being checked: one user's paid response can be replayed to another user.
+def cached_response(answers, prompt, api_key, url=None):
+    if not CACHE_ENABLED:
+        return llm_client.get_response(prompt, api_key, url)
+    key = cache_key(answers, prompt, url)
+    response = get_cache().get(key)
+    if response is not None:
+        return response
+    try:
+        response = llm_client.complete(prompt, api_key, url)
+    except LLMError as error:
+        return str(error)
+    get_cache().put(key, response)
+    return response
+
+
+# Streaming counterpart of cached_response: a hit is yielded in one piece (and, likewise, without
+# checking the API key)
+def cached_stream_response(answers, prompt, api_key, url=None):
+    if not CACHE_ENABLED:
+        yield from llm_client.stream_response(prompt, api_key, url)
+        return
+    key = cache_key(answers, prompt, url)
+    response = get_cache().get(key)
+    if response is not None:
+        yield response
+        return
+    tokens = []
+    try:
+        for token in llm_client.iter_completion(prompt, api_key, url):
+            tokens.append(token)
+            yield token
+    except LLMError as error:
+        yield str(error)
+        return
+    get_cache().put(key, ''.join(tokens))
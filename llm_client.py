@@ -0,0 +1,191 @@
+import collections
+import json
+import os
+import threading
+import time
+
+import httpx
+
+from metrics import percentile
+
+# Endpoint and client settings, overridable from the environment
+LLM_URL = os.environ.get('SFIE_LLM_URL', '')
+CONNECT_TIMEOUT = float(os.environ.get('SFIE_LLM_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.environ.get('SFIE_LLM_READ_TIMEOUT', 120))
+MAX_CONNECTIONS = int(os.environ.get('SFIE_LLM_MAX_CONNECTIONS', 20))
+MAX_CONCURRENCY = int(os.environ.get('SFIE_LLM_MAX_CONCURRENCY', MAX_CONNECTIONS))
+KEEPALIVE_EXPIRY = float(os.environ.get('SFIE_LLM_KEEPALIVE_EXPIRY', 30))
+STREAM = os.environ.get('SFIE_LLM_STREAM', '1') == '1'
+
+DEFAULT_PARAMS = {
+    "max_tokens": 1024,
+    "temperature": 0.7,
+    "top_p": 1,
+}
+
+_client = None
+_client_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+# Recent (time_to_first_token, total_latency) samples in seconds; ttft is None for non-streamed calls
+_timings = collections.deque(maxlen=1000)
+_timings_lock = threading.Lock()
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# Allow self-signed HTTPS certificates unless PYTHONHTTPSVERIFY is set (same rule as allowSelfSignedHttps)
+def verify_tls():
+    return bool(os.environ.get('PYTHONHTTPSVERIFY', ''))
+
+
+# One pooled keep-alive client per process, shared by every Streamlit session
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(
+                    http2=http2_available(),
+                    verify=verify_tls(),
+                    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                    limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                        max_keepalive_connections=MAX_CONNECTIONS,
+                                        keepalive_expiry=KEEPALIVE_EXPIRY),
+                )
+    return _client
+
+
+def build_request(prompt, stream=False, **params):
+    return {
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        **DEFAULT_PARAMS,
+        **params,
+        "stream": stream
+    }
+
+
+class LLMError(Exception):
+    pass
+
+
+def request_headers(api_key, stream=False):
+    headers = {'Content-Type': 'application/json', 'Authorization': ('Bearer ' + api_key)}
+    if stream:
+        headers['Accept'] = 'text/event-stream'
+    return headers
+
+
+# Blocking completion; raises LLMError with a user-facing message on failure
+def complete(prompt, api_key, url=None):
+    data = build_request(prompt)
+
+    with _slots:
+        start = time.perf_counter()
+        try:
+            response = get_client().post(url or LLM_URL, json=data, headers=request_headers(api_key))
+            response.raise_for_status()
+            content = response.json()['choices'][0]['message']['content']
+        except httpx.HTTPStatusError as error:
+            raise LLMError(f"The request failed with status code: {error.response.status_code}\n{error.response.text}")
+        except httpx.TimeoutException:
+            raise LLMError("The request timed out. Please try again.")
+        except httpx.HTTPError as error:
+            raise LLMError(f"The request failed: {error}")
+        _record(None, time.perf_counter() - start)
+        return content
+
+
+# Function to get response from Azure-based LLM
+def get_response(prompt, api_key, url=None):
+    try:
+        return complete(prompt, api_key, url)
+    except LLMError as error:
+        return str(error)
+
+
+# Pull the text delta out of one server-sent-event line ("data: {...}"); None for keep-alives and [DONE].
+# An event that isn't JSON, or that carries an error instead of a delta, raises LLMError.
+def _parse_event(line):
+    if not line.startswith('data:'):
+        return None
+    payload = line[len('data:'):].strip()
+    if not payload or payload == '[DONE]':
+        return None
+    try:
+        chunk = json.loads(payload)
+    except ValueError:
+        chunk = None
+    if not isinstance(chunk, dict):
+        raise LLMError(f"The request failed: malformed event from the server: {payload[:200]}")
+    if chunk.get('error'):
+        error = chunk['error']
+        raise LLMError(f"The request failed: {error.get('message', error) if isinstance(error, dict) else error}")
+    if not chunk.get('choices'):
+        return None
+    return chunk['choices'][0].get('delta', {}).get('content')
+
+
+# Streaming completion: yields tokens as the server produces them, raises LLMError on failure
+def iter_completion(prompt, api_key, url=None):
+    data = build_request(prompt, stream=True)
+
+    with _slots:
+        start = time.perf_counter()
+        first_token = None
+        try:
+            with get_client().stream('POST', url or LLM_URL, json=data,
+                                     headers=request_headers(api_key, stream=True)) as response:
+                if response.is_error:
+                    response.read()
+                    raise LLMError(f"The request failed with status code: {response.status_code}\n{response.text}")
+                for line in response.iter_lines():
+                    token = _parse_event(line)
+                    if token:
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        yield token
+        except httpx.TimeoutException:
+            raise LLMError("The request timed out. Please try again.")
+        except httpx.HTTPError as error:
+            raise LLMError(f"The request failed: {error}")
+        _record(first_token, time.perf_counter() - start)
+
+
+# Streaming variant of get_response
+def stream_response(prompt, api_key, url=None):
+    try:
+        yield from iter_completion(prompt, api_key, url)
+    except LLMError as error:
+        yield str(error)
+
+
+def _record(ttft, total):
+    with _timings_lock:
+        _timings.append((ttft, total))
+
+
+# Time-to-first-token and total latency over recent successful calls
+def llm_metrics():
+    with _timings_lock:
+        samples = list(_timings)
+    ttft = sorted(t for t, _ in samples if t is not None)
+    total = sorted(t for _, t in samples)
+    return {
+        "requests": len(samples),
+        "ttft_p50_s": percentile(ttft, 0.50),
+        "ttft_p95_s": percentile(ttft, 0.95),
+        "total_p50_s": percentile(total, 0.50),
+        "total_p95_s": percentile(total, 0.95),
+    }
@@ -0,0 +1,3 @@
+# The p-th percentile (0 <= p <= 1) of already sorted `values`, or None when there are none
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p * len(values)))] if values else None
@@ -0,0 +1,268 @@
+"""Local stand-in for the chat-completions endpoint, for offline load and latency testing.
+
+    python mock_llm_server.py --port 8008 --latency lognormal:0.4,0.5 --token-rate 40
+    SFIE_LLM_URL=http://127.0.0.1:8008/chat/completions streamlit run app.py
+
+Accepts the same request body llm_client.build_request() sends and answers with the
+chat-completions response schema, or server-sent "chat.completion.chunk" events when
+"stream" is true. Every request first waits a sampled latency (the time to first token),
+then produces its tokens at --token-rate per second. --error-rate and --rate-limit-rate
+make that fraction of requests fail with a 500 or a 429 (with Retry-After). Counters are
+served as JSON on GET /stats. Each option can also be set with its SFIE_MOCK_LLM_* variable.
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("cleanse gently twice daily with a pH-balanced cleanser then apply a lightweight niacinamide serum "
+         "follow with a non-comedogenic moisturizer and broad-spectrum SPF 50 every morning introduce a "
+         "retinoid two nights a week and increase slowly patch test new products before use").split()
+
+
+# Seconds from a spec such as "fixed:0.2", "uniform:0.1,0.5", "normal:0.3,0.05", "lognormal:0.4,0.5"
+# (median, sigma) or "exp:0.3" (mean); a bare number means fixed
+def parse_distribution(spec):
+    name, _, args = spec.partition(':')
+    if not args:
+        name, args = 'fixed', name
+    params = [float(a) for a in args.split(',')]
+    samplers = {
+        'fixed': lambda rng: params[0],
+        'uniform': lambda rng: rng.uniform(params[0], params[1]),
+        'normal': lambda rng: rng.gauss(params[0], params[1]),
+        'lognormal': lambda rng: params[0] * rng.lognormvariate(0, params[1]),
+        'exp': lambda rng: rng.expovariate(1 / params[0]),
+    }
+    if name not in samplers:
+        raise ValueError(f"Unknown latency distribution: {name}")
+    sampler = samplers[name]
+    return lambda rng: max(0.0, sampler(rng))
+
+
+class MockConfig:
+    def __init__(self, latency='0.2', token_rate=50.0, tokens=200, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1.0, seed=None):
+        self.latency = latency
+        self.sample_latency = parse_distribution(latency)
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        env = os.environ.get
+        seed = env('SFIE_MOCK_LLM_SEED')
+        return cls(
+            latency=env('SFIE_MOCK_LLM_LATENCY', '0.2'),
+            token_rate=float(env('SFIE_MOCK_LLM_TOKEN_RATE', 50)),
+            tokens=int(env('SFIE_MOCK_LLM_TOKENS', 200)),
+            error_rate=float(env('SFIE_MOCK_LLM_ERROR_RATE', 0)),
+            rate_limit_rate=float(env('SFIE_MOCK_LLM_RATE_LIMIT_RATE', 0)),
+            retry_after=float(env('SFIE_MOCK_LLM_RETRY_AFTER', 1)),
+            seed=int(seed) if seed else None,
+        )
+
+    # (outcome, latency): outcome is 'ok', 'error' or 'rate_limited'
+    def draw(self):
+        with self.rng_lock:
+            roll = self.rng.random()
+            latency = self.sample_latency(self.rng)
+        if roll < self.rate_limit_rate:
+            return 'rate_limited', 0.0
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 'error', latency
+        return 'ok', latency
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "streamed": 0, "ok": 0, "error": 0, "rate_limited": 0, "bad_request": 0,
+                       "in_flight": 0, "max_in_flight": 0}
+
+    def add(self, **deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self.counts[key] += delta
+            self.counts["max_in_flight"] = max(self.counts["max_in_flight"], self.counts["in_flight"])
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def _tokens(prompt, count):
+    seed = sum(prompt.encode('utf-8')) if prompt else 0
+    return [('' if i == 0 else ' ') + WORDS[(seed + i) % len(WORDS)] for i in range(count)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'SFIEMockLLM/1.0'
+    # Headers and body go out as separate writes; without this, Nagle + delayed ACK add ~40 ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.split('?')[0].rstrip('/') == '/stats':
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length)
+        if not self.path.split('?')[0].rstrip('/').endswith('chat/completions'):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        try:
+            body = json.loads(raw)
+            prompt = body['messages'][-1]['content']
+        except (ValueError, KeyError, IndexError, TypeError):
+            self.server.stats.add(bad_request=1)
+            self._send_json(400, {"error": {"message": "Invalid chat completions request"}})
+            return
+
+        config, stats = self.server.config, self.server.stats
+        stream = bool(body.get('stream'))
+        stats.add(requests=1, streamed=int(stream), in_flight=1)
+        try:
+            outcome, latency = config.draw()
+            if outcome == 'rate_limited':
+                stats.add(rate_limited=1)
+                self._send_json(429, {"error": {"code": "429", "message": "Rate limit exceeded (mock)"}},
+                                {'Retry-After': f"{config.retry_after:g}"})
+                return
+            time.sleep(latency)
+            if outcome == 'error':
+                stats.add(error=1)
+                self._send_json(500, {"error": {"message": "Internal server error (mock)"}})
+                return
+            tokens = _tokens(prompt, min(config.tokens, int(body.get('max_tokens') or config.tokens)))
+            if stream:
+                self._stream(tokens)
+            else:
+                self._complete(tokens)
+            stats.add(ok=1)
+        finally:
+            stats.add(in_flight=-1)
+
+    def _pace(self, start, produced):
+        if self.server.config.token_rate > 0:
+            delay = start + produced / self.server.config.token_rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _complete(self, tokens):
+        self._pace(time.perf_counter(), len(tokens))
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "sfie-mock",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": ''.join(tokens)},
+                         "finish_reason": "stop"}],
+            "usage": {"completion_tokens": len(tokens)},
+        })
+
+    def _chunk(self, data):
+        payload = f"data: {data}\n\n".encode('utf-8')
+        self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, tokens):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        start = time.perf_counter()
+        for i, token in enumerate(tokens):
+            delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+            self._chunk(json.dumps({"id": completion_id, "object": "chat.completion.chunk", "model": "sfie-mock",
+                                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}))
+            self._pace(start, i + 1)
+        self._chunk(json.dumps({"id": completion_id, "object": "chat.completion.chunk", "model": "sfie-mock",
+                                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        self._chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config, verbose=False):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.stats = _Stats()
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/chat/completions"
+
+
+# Start a server on a background thread (port 0 picks a free one); call .shutdown() when done
+def serve_in_thread(config=None, host='127.0.0.1', port=0):
+    server = MockLLMServer((host, port), config or MockConfig.from_env())
+    threading.Thread(target=server.serve_forever, name='mock-llm', daemon=True).start()
+    return server
+
+
+def main():
+    defaults = MockConfig.from_env()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SFIE_MOCK_LLM_PORT', 8008)))
+    parser.add_argument('--latency', default=defaults.latency,
+                        help="time to first token: fixed:S, uniform:A,B, normal:MU,SD, lognormal:MEDIAN,SIGMA or exp:MEAN")
+    parser.add_argument('--token-rate', type=float, default=defaults.token_rate, help="tokens/sec (0: instant)")
+    parser.add_argument('--tokens', type=int, default=defaults.tokens, help="response length, capped by max_tokens")
+    parser.add_argument('--error-rate', type=float, default=defaults.error_rate, help="fraction answered with 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=defaults.rate_limit_rate,
+                        help="fraction answered with 429")
+    parser.add_argument('--retry-after', type=float, default=defaults.retry_after)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every request")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.token_rate, args.tokens, args.error_rate, args.rate_limit_rate,
+                        args.retry_after, args.seed)
+    server = MockLLMServer((args.host, args.port), config, args.verbose)
+    print(f"Mock LLM listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
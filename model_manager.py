@@ -0,0 +1,335 @@
+import atexit
+import collections
+import gc
+import glob
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import model_registry
+from metrics import percentile
+from model_registry import file_sha256
+
+logger = logging.getLogger(__name__)
+
+# Directory of versioned .pkl artifacts; the newest one serves predict() and a newer file replaces it
+MODEL_DIR = os.environ.get('SFIE_MODEL_DIR', '')
+# Candidate artifact that gets CANDIDATE_PERCENT of the photos (A/B), reloaded when the file changes
+CANDIDATE = os.environ.get('SFIE_CANDIDATE_MODEL', '')
+CANDIDATE_PERCENT = float(os.environ.get('SFIE_CANDIDATE_PERCENT', 0))
+# Seconds between checks for new artifacts, and between per-version summary log lines (0: no log)
+POLL_SECONDS = float(os.environ.get('SFIE_MODEL_POLL_SECONDS', 5))
+LOG_INTERVAL = float(os.environ.get('SFIE_MODEL_LOG_INTERVAL', 60))
+# Every loaded version is served from a private copy here, so rewriting or deleting the source file
+# never changes a model that still has predictions in flight
+STORE_DIR = os.environ.get('SFIE_MODEL_STORE', os.path.join(tempfile.gettempdir(), 'sfie-models'))
+# The manager serves predict() when hot reload is asked for or there is something to watch
+MANAGED = os.environ.get('SFIE_MODEL_HOT_RELOAD', '0') == '1' or bool(MODEL_DIR or CANDIDATE)
+
+# Files younger than this may still be being written
+SETTLE_SECONDS = 1.0
+
+
+# Newest .pkl in `directory`, or None
+def newest_artifact(directory):
+    paths = glob.glob(os.path.join(directory, '*.pkl'))
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+_stores = set()
+_stores_lock = threading.Lock()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists, but belongs to another user
+        return True
+    return True
+
+
+# This process's directory under `store_dir`. The first call removes the directories of processes that
+# are gone (killed before their exit hook ran) and registers this one for removal at exit.
+def _process_store(store_dir):
+    own = os.path.join(store_dir, str(os.getpid()))
+    with _stores_lock:
+        if own not in _stores:
+            for entry in os.listdir(store_dir) if os.path.isdir(store_dir) else []:
+                if entry.isdigit() and int(entry) != os.getpid() and not _pid_alive(int(entry)):
+                    shutil.rmtree(os.path.join(store_dir, entry), ignore_errors=True)
+            _stores.add(own)
+            atexit.register(shutil.rmtree, own, ignore_errors=True)
+    os.makedirs(own, exist_ok=True)
+    return own
+
+
+# Copy `path` into this process's store; returns (copy, sha256 of the copy). Every version gets its own
+# file, even with the same contents, so unloading one never takes the file away from another.
+def snapshot(path, store_dir=STORE_DIR):
+    store_dir = _process_store(store_dir)
+    fd, copy = tempfile.mkstemp(prefix=os.path.splitext(os.path.basename(path))[0] + '-', suffix='.pkl',
+                                dir=store_dir)
+    os.close(fd)
+    try:
+        shutil.copyfile(path, copy)
+        return copy, file_sha256(copy)
+    except BaseException:
+        os.remove(copy)
+        raise
+
+
+# Backend serving one version: the worker pool when configured for the direct backend, else in-process
+def version_backend(path, backend_name):
+    from backends import make_backend
+    from inference_pool import WORKERS, ProcessPoolBackend
+
+    if WORKERS and backend_name == 'direct':
+        return ProcessPoolBackend(path, WORKERS)
+    # Exported graphs are built from one Learner offline; versions are swapped as Learners
+    return make_backend(backend_name if backend_name == 'direct' else 'fastai', path)
+
+
+# One loaded artifact: its backend, in-flight count and per-version latency and top-1 counts
+class ModelVersion:
+    def __init__(self, source, path, sha256, backend, stats_window=1000):
+        self.source = source
+        self.path = path
+        self.sha256 = sha256
+        self.backend = backend
+        self.label = f"{os.path.basename(source)}@{sha256[:8]}"
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self.retired = False
+        self.photos = 0
+        self._latency = collections.deque(maxlen=stats_window)
+        self._top1 = collections.Counter()
+        self._lock = threading.Lock()
+
+    def predict(self, imgs):
+        start = time.perf_counter()
+        results = self.backend.predict_batch(imgs)
+        per_photo = (time.perf_counter() - start) / len(imgs)
+        with self._lock:
+            self.photos += len(imgs)
+            self._latency.extend([per_photo] * len(imgs))
+            self._top1.update(max(r, key=r.get) for r in results)
+        return results
+
+    def stats(self):
+        with self._lock:
+            latency = sorted(self._latency)
+            top1 = dict(self._top1)
+            photos = self.photos
+        total = sum(top1.values())
+        return {
+            "source": self.source,
+            "sha256": self.sha256,
+            "loaded_at": self.loaded_at,
+            "in_flight": self.in_flight,
+            "photos": photos,
+            "p50_s": percentile(latency, 0.50),
+            "p95_s": percentile(latency, 0.95),
+            "top1_share": {c: n / total for c, n in sorted(top1.items())} if total else {},
+        }
+
+    # Drop everything holding the weights; called once the last in-flight batch is done
+    def unload(self):
+        close = getattr(self.backend, 'close', None)
+        if close is not None:
+            close()
+        self.backend = None
+        model_registry.evict(self.path)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        gc.collect()
+        logger.info("Unloaded model %s", self.label)
+
+
+# Backend that serves the active artifact, sends a share of photos to a candidate, and swaps in a new
+# artifact without a restart: batches already running finish on the version they started on, and a
+# replaced version is unloaded once its last batch is done
+class ModelManager:
+    def __init__(self, model_path='export.pkl', backend_name='fastai', model_dir=MODEL_DIR, candidate=CANDIDATE,
+                 candidate_percent=CANDIDATE_PERCENT, poll_seconds=POLL_SECONDS, log_interval=LOG_INTERVAL,
+                 store_dir=STORE_DIR, make_version_backend=version_backend):
+        self.model_path = model_path
+        self.backend_name = backend_name
+        self.model_dir = model_dir
+        self.candidate_path = candidate
+        self.candidate_percent = candidate_percent
+        self.store_dir = store_dir
+        self.make_version_backend = make_version_backend
+        self.swaps = 0
+        self._lock = threading.Lock()
+        # Swaps are made by the watcher thread only; this guards manual reload() calls against it
+        self._reload_lock = threading.Lock()
+        self._seen = {}
+        self._rng = random.Random()
+        self._active = self._load(self._active_source())
+        self._candidate = self._load(candidate) if candidate and os.path.exists(candidate) else None
+        self.name = f'managed:{self._active.backend.name}'
+        self.concurrency = getattr(self._active.backend, 'concurrency', 1)
+        if poll_seconds:
+            threading.Thread(target=self._watch, args=(poll_seconds, log_interval), name='sfie-model-watch',
+                             daemon=True).start()
+
+    def _active_source(self):
+        return (newest_artifact(self.model_dir) if self.model_dir else None) or self.model_path
+
+    def _load(self, source):
+        start = time.perf_counter()
+        self._seen[source] = self._signature(source)
+        path, sha256 = snapshot(source, self.store_dir)
+        backend = self.make_version_backend(path, self.backend_name)
+        # Loads the weights now, on the watcher thread, rather than in the first request after the swap
+        backend.version()
+        version = ModelVersion(source, path, sha256, backend)
+        logger.info("Loaded model %s in %.2fs", version.label, time.perf_counter() - start)
+        return version
+
+    @staticmethod
+    def _signature(path):
+        stat = os.stat(path)
+        return stat.st_mtime, stat.st_size
+
+    # True when `path` differs from what was last loaded from it and has stopped changing
+    def _changed(self, path):
+        try:
+            signature = self._signature(path)
+        except OSError:
+            return False
+        return signature != self._seen.get(path) and time.time() - signature[0] >= SETTLE_SECONDS
+
+    # The active and candidate versions; both stay loaded until the batch calls _release()
+    def _acquire(self):
+        with self._lock:
+            active, candidate = self._active, self._candidate
+            for version in (active, candidate):
+                if version is not None:
+                    version.in_flight += 1
+        return active, candidate
+
+    def _release(self, version):
+        with self._lock:
+            version.in_flight -= 1
+            drained = version.retired and version.in_flight == 0
+        if drained:
+            version.unload()
+
+    # Atomically make `version` the active (or candidate) one; the one it replaces is retired
+    def _swap(self, version, candidate=False):
+        with self._lock:
+            old = self._candidate if candidate else self._active
+            if candidate:
+                self._candidate = version
+            else:
+                self._active = version
+            self.swaps += 1
+            drained = False
+            if old is not None and old is not version:
+                old.retired = True
+                drained = old.in_flight == 0
+        logger.info("%s model is now %s (was %s)", 'Candidate' if candidate else 'Active',
+                    version.label if version else None, old.label if old else None)
+        if drained:
+            old.unload()
+
+    def _replace(self, source, current, candidate=False):
+        if not self._changed(source):
+            return
+        sha256 = file_sha256(source)
+        if current is not None and sha256 == current.sha256:
+            # Touched or copied without a new model: keep the loaded one
+            self._seen[source] = self._signature(source)
+            return
+        try:
+            version = self._load(source)
+        except Exception:
+            logger.exception("Loading model %s failed; still serving %s", source,
+                             current.label if current else None)
+            # Not retried until the file changes again
+            self._seen[source] = self._signature(source)
+            return
+        self._swap(version, candidate)
+
+    # Pick up a new or rewritten active artifact and candidate; the watcher calls this every poll
+    def reload(self):
+        with self._reload_lock:
+            source = self._active_source()
+            if os.path.exists(source):
+                self._replace(source, self._active)
+            if self.candidate_path and os.path.exists(self.candidate_path):
+                self._replace(self.candidate_path, self._candidate, candidate=True)
+            elif self._candidate is not None:
+                self._swap(None, candidate=True)
+
+    def _watch(self, poll_seconds, log_interval):
+        last_log = time.monotonic()
+        while True:
+            time.sleep(poll_seconds)
+            try:
+                self.reload()
+            except Exception:
+                logger.exception("Checking for new model artifacts failed")
+            if log_interval and time.monotonic() - last_log >= log_interval:
+                last_log = time.monotonic()
+                self.log_stats()
+
+    def log_stats(self):
+        for role, version in (("active", self._active), ("candidate", self._candidate)):
+            if version is None:
+                continue
+            s = version.stats()
+            logger.info("%s model %s: %d photos, p50 %s, p95 %s, top-1 %s", role, version.label, s["photos"],
+                        f"{s['p50_s'] * 1000:.1f} ms" if s["p50_s"] is not None else "n/a",
+                        f"{s['p95_s'] * 1000:.1f} ms" if s["p95_s"] is not None else "n/a",
+                        ', '.join(f"{c} {share:.0%}" for c, share in s["top1_share"].items()) or "-")
+
+    # The active version's classes; a candidate with other classes would make A/B results incomparable
+    def vocab(self):
+        return self._active.backend.vocab()
+
+    # Results depend on which versions serve and how photos are split, so all of it keys the cache
+    def version(self):
+        active, candidate = self._active, self._candidate
+        if candidate is None or not self.candidate_percent:
+            return f"managed:{active.sha256}"
+        return f"managed:{active.sha256}:{candidate.sha256}:{self.candidate_percent:g}"
+
+    def predict_batch(self, imgs):
+        if not imgs:
+            return []
+        active, candidate = self._acquire()
+        try:
+            routes = [candidate if candidate is not None and self._rng.random() * 100 < self.candidate_percent
+                      else active for _ in imgs]
+            results = [None] * len(imgs)
+            for version in (active, candidate):
+                indices = [i for i, v in enumerate(routes) if v is version]
+                if indices:
+                    for i, result in zip(indices, version.predict([imgs[i] for i in indices])):
+                        results[i] = result
+            return results
+        finally:
+            for version in (active, candidate):
+                if version is not None:
+                    self._release(version)
+
+    def stats(self):
+        active, candidate = self._active, self._candidate
+        return {
+            "active": active.label,
+            "candidate": candidate.label if candidate else None,
+            "candidate_percent": self.candidate_percent if candidate else 0,
+            "swaps": self.swaps,
+            "versions": {v.label: v.stats() for v in (active, candidate) if v is not None},
+        }
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import pathlib
+import platform
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Handle different OS paths (export.pkl was pickled on Windows)
+if platform.system() == 'Linux':
+    pathlib.WindowsPath = pathlib.PosixPath
+
+# One entry per model artifact, shared by every Streamlit session in this process
+_entries = {}
+_lock = threading.Lock()
+
+
+class ModelEntry:
+    def __init__(self, path, model, mtime, sha256, load_seconds, rss_delta_mb):
+        self.path = path
+        self.model = model
+        self.mtime = mtime
+        self.sha256 = sha256
+        self.load_seconds = load_seconds
+        self.rss_delta_mb = rss_delta_mb
+        self.loaded_at = time.time()
+        self.loads = 1
+        self.hits = 0
+
+
+# Resident set size of this process in MB (None where it can't be read)
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        # Without /proc the peak is the closest figure there is
+        return peak_rss_mb()
+
+
+# Peak resident set size of this process in MB (None where it can't be read)
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except (ImportError, OSError):
+        return None
+    # ru_maxrss is bytes on macOS and KB elsewhere
+    return peak / 2 ** 20 if platform.system() == 'Darwin' else peak / 2 ** 10
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def unpickle_learner(path):
+    from fastai.learner import load_learner
+    return load_learner(path)
+
+
+def _load(path, mtime, sha256, loader):
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    model = loader(path)
+    load_seconds = time.perf_counter() - start
+    rss_after = rss_mb()
+    rss_delta = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+
+    logger.info("Loaded %s in %.2fs (rss delta %s MB)", path, load_seconds,
+                f"{rss_delta:.1f}" if rss_delta is not None else "n/a")
+    return ModelEntry(path, model, mtime, sha256, load_seconds, rss_delta)
+
+
+# Return the model stored at `path`, calling `loader` only on first use or when the file changed
+def get_model(path, loader):
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+
+    entry = _entries.get(path)
+    if entry is not None and entry.mtime == mtime:
+        entry.hits += 1
+        return entry.model
+
+    with _lock:
+        entry = _entries.get(path)
+        if entry is not None and entry.mtime == mtime:
+            entry.hits += 1
+            return entry.model
+
+        sha256 = file_sha256(path)
+        if entry is not None and entry.sha256 == sha256:
+            # Touched but not rewritten: keep the loaded model
+            entry.mtime = mtime
+            entry.hits += 1
+            return entry.model
+
+        loads = entry.loads + 1 if entry is not None else 1
+        entry = _load(path, mtime, sha256, loader)
+        entry.loads = loads
+        _entries[path] = entry
+        return entry.model
+
+
+# Return the Learner for `path`, unpickling it only on first use or when the file changed
+def get_learner(path='export.pkl'):
+    return get_model(path, unpickle_learner)
+
+
+# Forget the model loaded from `path`, so its memory is freed once nothing else holds it
+def evict(path):
+    with _lock:
+        return _entries.pop(os.path.abspath(path), None) is not None
+
+
+# Content hash of the currently loaded model, used as a model version
+def model_version(path='export.pkl', loader=unpickle_learner):
+    get_model(path, loader)
+    return _entries[os.path.abspath(path)].sha256
+
+
+# Load-time and memory metrics for every model loaded in this process
+def model_metrics():
+    return {
+        path: {
+            "sha256": entry.sha256,
+            "loads": entry.loads,
+            "hits": entry.hits,
+            "load_seconds": entry.load_seconds,
+            "rss_delta_mb": entry.rss_delta_mb,
+            "loaded_at": entry.loaded_at,
+        }
+        for path, entry in _entries.items()
+    }
@@ -1,9 +1,12 @@
 import streamlit as st
-import urllib.request
-import json
 import os
 import ssl
 
+from llm_client import get_response, stream_response, STREAM
+from llm_cache import cached_response, cached_stream_response
+from relevance import is_psychology_related
+from prompts import build_prompt
+
 st.set_page_config(
     page_title="SFIE Beauty Sandbox"
 )
@@ -54,56 +57,16 @@ def sfie_beauty_llm():
         elif not is_psychology_related(prompt):
             st.error("Irrelevant prompt.")
         else:
-            with st.spinner('Processing...'):
-                response = get_response(prompt, api_key)
-                st.success("Done!")
+            if STREAM:
                 st.write("Response:")
-                st.write(response)
-
-
-# Function to check if the prompt is psychology-related
-def is_psychology_related(prompt):
-    psychology_keywords = [
-        'skincare', 'skin health', 'skin type', 'skincare routine', 'skincare products', 'moisturizer',
-        'cleanser', 'toner', 'serum', 'sunscreen', 'exfoliation', 'hydration', 'acne treatment',
-        'anti-aging', 'hyperpigmentation', 'sensitive skin', 'dry skin', 'oily skin', 'combination skin',
-        'skin barrier', 'collagen', 'retinol', 'vitamin C', 'hyaluronic acid', 'niacinamide',
-        'peptides', 'AHAs', 'BHAs', 'natural skincare', 'dermatologist', 'facial', 'skin concerns',
-        'dark spots', 'redness', 'blemishes', 'eczema', 'psoriasis', 'rosacea', 'dermatitis',
-        'pore size', 'skin texture', 'skin tone', 'under-eye care', 'skin detox', 'allergic reactions'
-    ]
-    return any(keyword.lower() in prompt.lower() for keyword in psychology_keywords)
-
-
-# Function to get response from Azure-based LLM
-def get_response(prompt, api_key):
-    data = {
-        "messages": [
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ],
-        "max_tokens": 1024,
-        "temperature": 0.7,
-        "top_p": 1,
-        "stream": False
-    }
-
-    body = str.encode(json.dumps(data))
-
-    url = ''
-    headers = {'Content-Type': 'application/json', 'Authorization': ('Bearer ' + api_key)}
-
-    req = urllib.request.Request(url, body, headers)
-
-    try:
-        response = urllib.request.urlopen(req)
-        result = response.read()
-        result_json = json.loads(result)
-        return result_json['choices'][0]['message']['content']
-    except urllib.error.HTTPError as error:
-        return f"The request failed with status code: {error.code}\n{error.read().decode('utf8', 'ignore')}"
+                st.write_stream(stream_response(prompt, api_key))
+                st.success("Done!")
+            else:
+                with st.spinner('Processing...'):
+                    response = get_response(prompt, api_key)
+                    st.success("Done!")
+                    st.write("Response:")
+                    st.write(response)
 
 
 # Personalized Beauty Care app
@@ -323,26 +286,20 @@ def process_results():
     }
 
     # Generate the prompt
-    prompt = f"""
-    Based on the answers provided from the questionnaire, could you provide skincare product recommendations, 
-    treatment alternatives, and a skincare diagnosis and routine planner for 1 month? Here are the details:
-    - Skin goals: {answers['skin_goals']}
-    - Skin type: {answers['skin_type']}
-    - Reaction frequency: {answers['reaction_frequency']}
-    - Skin tone: {answers['skin_tone']}
-    - Recent skin symptoms: {answers['skin_symptoms']}
-    - Skin conditions: {answers['skin_conditions']}
-    - Date of birth: {answers['birthday']}
-    """
+    prompt = build_prompt(answers)
 
     # Assume API key is already stored in the session
     api_key = st.text_input("Enter your API key:", type="password")
 
     if api_key:
-        with st.spinner("Getting your skincare recommendations..."):
-            response = get_response(prompt, api_key)
+        if STREAM:
             st.success("Here are your personalized skincare recommendations!")
-            st.write(response)
+            st.write_stream(cached_stream_response(answers, prompt, api_key))
+        else:
+            with st.spinner("Getting your skincare recommendations..."):
+                response = cached_response(answers, prompt, api_key)
+                st.success("Here are your personalized skincare recommendations!")
+                st.write(response)
     else:
         st.error("API key missing. Please provide your API key in the SFIE Beauty LLM section.")
 
@@ -0,0 +1,110 @@
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Cache settings, overridable from the environment; the disk tier is off unless a path is given
+CACHE_ENABLED = os.environ.get('SFIE_PREDICTION_CACHE', '1') == '1'
+CACHE_MAX_ENTRIES = int(os.environ.get('SFIE_PREDICTION_CACHE_MAX_ENTRIES', 2048))
+CACHE_PATH = os.environ.get('SFIE_PREDICTION_CACHE_PATH', '')
+CACHE_DISK_MAX_ENTRIES = int(os.environ.get('SFIE_PREDICTION_CACHE_DISK_MAX_ENTRIES', 100000))
+
+
+# Hash of the decoded pixels plus the model version; identical photos hit regardless of file name
+def image_key(img, version):
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{version}|{img.mode}|{img.size[0]}x{img.size[1]}|".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+# SQLite second tier so predictions survive restarts and are shared between server processes
+class _DiskTier:
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS predictions_accessed ON predictions (accessed)")
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT result FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE predictions SET accessed = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO predictions (key, result, accessed) VALUES (?, ?, ?)",
+                             (key, json.dumps(result), time.time()))
+            overflow = self._db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._db.execute(
+                    "DELETE FROM predictions WHERE key IN (SELECT key FROM predictions ORDER BY accessed LIMIT ?)",
+                    (overflow,),
+                )
+
+
+# In-memory LRU of {label: prob} results with an optional on-disk tier behind it
+class PredictionCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, path=CACHE_PATH, disk_max_entries=CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = _DiskTier(path, disk_max_entries) if path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+        if self._disk is not None:
+            result = self._disk.get(key)
+            if result is not None:
+                self._remember(key, result)
+                with self._lock:
+                    self.disk_hits += 1
+                return result
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        self._remember(key, result)
+        if self._disk is not None:
+            self._disk.put(key, result)
+
+    # Stored as a plain dict: attributes a backend hangs on its result (a cascade's .tier) describe
+    # the call that computed it, not a later cache hit
+    def _remember(self, key, result):
+        with self._lock:
+            self._entries[key] = dict(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            hits, disk_hits, misses, size = self.hits, self.disk_hits, self.misses, len(self._entries)
+        lookups = hits + disk_hits + misses
+        return {
+            "entries": size,
+            "hits": hits,
+            "disk_hits": disk_hits,
+            "misses": misses,
+            "hit_rate": (hits + disk_hits) / lookups if lookups else None,
+        }
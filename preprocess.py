@@ -0,0 +1,162 @@
+import json
+import math
+import threading
+
+from PIL import Image
+
+# ImageNet statistics, used by cnn_learner's Normalize when the spec doesn't carry its own
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+# Validation-time item/batch pipeline of a Learner as plain data, so it can run without fastai.
+# Sizes are (width, height), as fastai stores them.
+def preprocess_spec(learn):
+    from fastai.data.transforms import Normalize
+    from fastai.vision.augment import RandomResizedCrop, Resize
+
+    spec = {"vocab": [str(v) for v in learn.dls.vocab], "resize": None, "crop": None,
+            "mean": IMAGENET_MEAN, "std": IMAGENET_STD}
+    for t in learn.dls.valid.after_item.fs:
+        if isinstance(t, RandomResizedCrop):
+            # On the validation set: squish to size + val_xtra margin, then one final center crop
+            xtra = math.ceil(max(*t.size[:2]) * t.val_xtra / 8) * 8
+            spec["resize"] = {"method": "squish", "size": [t.size[0] + xtra, t.size[1] + xtra]}
+            spec["crop"] = list(t.size)
+        elif isinstance(t, Resize):
+            spec["resize"] = {"method": str(t.method), "size": list(t.size), "pad_mode": str(t.pad_mode)}
+    for t in learn.dls.valid.after_batch.fs:
+        if isinstance(t, Normalize):
+            spec["mean"] = t.mean.detach().cpu().flatten().tolist()
+            spec["std"] = t.std.detach().cpu().flatten().tolist()
+    return spec
+
+
+def save_spec(spec, path):
+    with open(path, 'w') as f:
+        json.dump(spec, f, indent=2)
+
+
+def load_spec(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _center_crop(img, size):
+    w, h = img.size
+    left, top = (w - size[0]) // 2, (h - size[1]) // 2
+    return img.crop((left, top, left + size[0], top + size[1]))
+
+
+_PAD_MODES = {"zeros": "constant", "border": "edge", "reflection": "reflect"}
+
+
+# fastai's crop_pad: crop the part of the box inside the image, pad the part outside it
+def _crop_pad(img, cp_sz, tl, pad_mode):
+    import numpy as np
+
+    w, h = img.size
+    left, top = tl
+    img = img.crop((max(left, 0), max(top, 0), min(left + cp_sz[0], w), min(top + cp_sz[1], h)))
+    pad = ((max(-top, 0), max(top + cp_sz[1] - h, 0)), (max(-left, 0), max(left + cp_sz[0] - w, 0)), (0, 0))
+    if any(p for dim in pad for p in dim):
+        img = Image.fromarray(np.pad(np.asarray(img), pad, mode=_PAD_MODES.get(pad_mode, "reflect")))
+    return img
+
+
+# Resize exactly like fastai's Resize(method=crop/pad/squish) does on the validation set
+def _resize(img, resize):
+    size = tuple(resize["size"])
+    method = resize["method"]
+    if method == "squish":
+        return img.resize(size, Image.BILINEAR)
+
+    w, h = img.size
+    if method == "pad":
+        m = w / size[0] if w / size[0] > h / size[1] else h / size[1]
+    else:
+        m = w / size[0] if w / size[0] < h / size[1] else h / size[1]
+    cp_sz = (int(m * size[0]), int(m * size[1]))
+    tl = (int(0.5 * (w - cp_sz[0])), int(0.5 * (h - cp_sz[1])))
+    return _crop_pad(img, cp_sz, tl, resize.get("pad_mode")).resize(size, Image.BILINEAR)
+
+
+# PIL image -> RGB PIL image at the model's input size
+def prepare_image(img, spec):
+    img = img.convert('RGB')
+    if spec.get("resize"):
+        img = _resize(img, spec["resize"])
+    if spec.get("crop"):
+        img = _center_crop(img, spec["crop"])
+    return img
+
+
+def _staging_size(spec):
+    resize = spec.get("resize")
+    if resize:
+        return tuple(resize["size"])
+    return tuple(spec["crop"])
+
+
+# Reusable uint8 NHWC staging buffer: each image is decoded and resized straight into its slot,
+# then crop/scale/normalize run once over the whole batch
+class BatchBuffer:
+    def __init__(self, spec, capacity=16):
+        self.spec = spec
+        self.width, self.height = _staging_size(spec)
+        self._array = None
+        self._reserve(capacity)
+
+    def _reserve(self, n):
+        import numpy as np
+
+        if self._array is None or len(self._array) < n:
+            self._array = np.empty((n, self.height, self.width, 3), dtype=np.uint8)
+
+    # uint8 NHWC view of `imgs` after resize and center crop
+    def fill(self, imgs):
+        import numpy as np
+
+        self._reserve(len(imgs))
+        resize = self.spec.get("resize")
+        for i, img in enumerate(imgs):
+            img = img.convert('RGB')
+            if resize:
+                img = _resize(img, resize)
+            elif img.size != (self.width, self.height):
+                img = _center_crop(img, (self.width, self.height))
+            self._array[i] = np.asarray(img)
+        batch = self._array[:len(imgs)]
+        if self.spec.get("crop") and resize:
+            w, h = self.spec["crop"]
+            left, top = (self.width - w) // 2, (self.height - h) // 2
+            batch = batch[:, top:top + h, left:left + w]
+        return batch
+
+
+_local = threading.local()
+
+
+def _buffer(spec):
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None or buffer.spec is not spec:
+        buffer = _local.buffer = BatchBuffer(spec)
+    return buffer
+
+
+# Stack images into one uint8 NCHW tensor; scaling and normalization happen inside the exported graph
+def to_batch(imgs, spec):
+    import torch
+
+    return torch.from_numpy(_buffer(spec).fill(imgs)).permute(0, 3, 1, 2).contiguous()
+
+
+# Stack images into the normalized float NCHW batch fastai would feed the model.
+# The result is channels-last in memory, which CPU convolutions prefer.
+def to_normalized_batch(imgs, spec):
+    import torch
+
+    batch = torch.from_numpy(_buffer(spec).fill(imgs)).permute(0, 3, 1, 2)
+    mean = torch.tensor(spec["mean"], dtype=torch.float32).view(1, -1, 1, 1)
+    std = torch.tensor(spec["std"], dtype=torch.float32).view(1, -1, 1, 1)
+    return batch.float().div_(255.).sub_(mean).div_(std)
@@ -0,0 +1,28 @@
+# Questionnaire fields collected by screens 2-8, in prompt order
+ANSWER_FIELDS = [
+    "skin_goals",
+    "skin_type",
+    "reaction_frequency",
+    "skin_tone",
+    "skin_symptoms",
+    "skin_conditions",
+    "birthday",
+]
+
+# Multi-select answers (lists); the rest are single strings
+LIST_FIELDS = {"skin_goals", "skin_symptoms", "skin_conditions"}
+
+
+# Generate the recommendation prompt from the questionnaire answers
+def build_prompt(answers):
+    return f"""
+    Based on the answers provided from the questionnaire, could you provide skincare product recommendations, 
+    treatment alternatives, and a skincare diagnosis and routine planner for 1 month? Here are the details:
+    - Skin goals: {answers['skin_goals']}
+    - Skin type: {answers['skin_type']}
+    - Reaction frequency: {answers['reaction_frequency']}
+    - Skin tone: {answers['skin_tone']}
+    - Recent skin symptoms: {answers['skin_symptoms']}
+    - Skin conditions: {answers['skin_conditions']}
+    - Date of birth: {answers['birthday']}
+    """
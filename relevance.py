@@ -0,0 +1,85 @@
+import os
+import re
+
+KEYWORDS_PATH = os.environ.get(
+    'SFIE_KEYWORDS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'relevance_keywords.txt'))
+
+
+def load_keywords(path=KEYWORDS_PATH):
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+# Turn a keyword trie into a regex, so shared prefixes are tested once instead of once per keyword
+def _trie_pattern(node):
+    if not node:
+        return ''
+    end = '' in node
+    branches = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items()) if ch != '']
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if end:
+        return '(?:' + body + ')?'
+    return body
+
+
+def build_trie(keywords):
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword.lower():
+            node = node.setdefault(ch, {})
+        node[''] = {}
+    return trie
+
+
+# Every keyword that is a prefix of `text`, found by walking the trie along it
+def prefix_keywords(trie, text):
+    found, node = [], trie
+    for i, ch in enumerate(text):
+        node = node.get(ch)
+        if node is None:
+            break
+        if '' in node:
+            found.append(text[:i + 1])
+    return found
+
+
+def compile_matcher(keywords):
+    trie = build_trie(keywords)
+    if not trie:
+        return re.compile('(?!)')
+    # Zero-width lookahead so overlapping keywords starting at different positions are all reported;
+    # at each position it captures the longest keyword only (see RelevanceGate.topics for the others).
+    # Matched against lowercased text: much faster than re.IGNORECASE.
+    return re.compile('(?=(' + _trie_pattern(trie) + '))')
+
+
+class RelevanceGate:
+    def __init__(self, keywords):
+        self.keywords = {k.lower(): k for k in keywords}
+        self._trie = build_trie(keywords)
+        self._pattern = compile_matcher(keywords)
+
+    # Single pass over the prompt; returns the keywords (as spelled in the vocabulary) that occur in it.
+    # The text fixes the trie path at each position, so the shorter keywords starting there are exactly
+    # the prefixes of the captured one ('skincare' inside 'skincare routine').
+    def topics(self, prompt):
+        return {self.keywords[k] for m in self._pattern.finditer(prompt.lower())
+                for k in prefix_keywords(self._trie, m.group(1))}
+
+    def __call__(self, prompt):
+        return self._pattern.search(prompt.lower()) is not None
+
+
+gate = RelevanceGate(load_keywords())
+
+
+# Function to check if the prompt is psychology-related
+def is_psychology_related(prompt):
+    return gate(prompt)
+
+
+def matched_topics(prompt):
+    return gate.topics(prompt)
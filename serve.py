@@ -0,0 +1,37 @@
+"""Start the app with warm-up and the readiness endpoint running before the first session.
+
+    SFIE_READY_PORT=8502 python serve.py
+    SFIE_READY_PORT=8502 python serve.py --server.port 8501 --server.headless true
+
+`streamlit run app.py` only imports app.py, and so only starts warm-up and /ready, once a first
+session runs the script, and a load balancer waiting for /ready would never send that session.
+This launcher starts warm-up, GET /ready on SFIE_READY_PORT and the telemetry endpoint in the
+process first, then runs `streamlit run app.py` with the remaining arguments in the same process,
+where app.py's own start() calls find them already running. Run it from the repository directory,
+like `streamlit run`, so the relative model and catalog paths match the app's.
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     epilog="other arguments are passed to `streamlit run`")
+    _, streamlit_args = parser.parse_known_args()
+
+    import telemetry
+    import warmup
+
+    warmup.start()
+    telemetry.start()
+
+    from streamlit.web import cli
+    sys.argv = ['streamlit', 'run', os.path.join(ROOT, 'app.py'), *streamlit_args]
+    sys.exit(cli.main())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+import bisect
+import contextlib
+import logging
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from model_registry import rss_mb
+
+logger = logging.getLogger(__name__)
+
+# Instrumentation settings, overridable from the environment; everything is off by default
+DEBUG_PANEL = os.environ.get('SFIE_DEBUG_PANEL', '0') == '1'
+ENABLED = os.environ.get('SFIE_TELEMETRY', '0') == '1' or DEBUG_PANEL
+# Prometheus text endpoint (GET /metrics) on this port; 0 disables it
+METRICS_PORT = int(os.environ.get('SFIE_METRICS_PORT', 0))
+# Seconds between summary log lines; 0 disables them
+LOG_INTERVAL = float(os.environ.get('SFIE_TELEMETRY_LOG_INTERVAL', 0))
+
+# Histogram bucket upper bounds in seconds, from cache hits up to slow LLM answers
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+# Spans of the script run in progress; Streamlit runs each session's script on its own thread
+_rerun = threading.local()
+_started = False
+_start_lock = threading.Lock()
+_NOOP = contextlib.nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    # Upper bound of the bucket holding the p-th quantile
+    def quantile(self, p):
+        counts, _, count = self.snapshot()
+        if not count:
+            return None
+        target, seen = p * count, 0
+        for bound, n in zip(self.buckets, counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return self.buckets[-1]
+
+
+def _histogram(stage):
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(stage, Histogram())
+    return histogram
+
+
+def record(stage, seconds):
+    _histogram(stage).observe(seconds)
+    spans = getattr(_rerun, 'spans', None)
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+class _Span:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+# `with span("predict"): ...` times the block; a shared no-op context when instrumentation is off
+def span(stage):
+    if not ENABLED:
+        return _NOOP
+    return _Span(stage)
+
+
+# Start collecting this thread's spans for the debug panel (call at the top of the script)
+def begin_rerun():
+    if ENABLED:
+        _rerun.spans = []
+        _rerun.start = time.perf_counter()
+
+
+# This rerun's spans as (stage, seconds) in completion order, plus the rerun's elapsed time so far
+def rerun_breakdown():
+    spans = list(getattr(_rerun, 'spans', None) or [])
+    start = getattr(_rerun, 'start', None)
+    return spans, (time.perf_counter() - start) if start is not None else None
+
+
+def stage_metrics():
+    with _histograms_lock:
+        histograms = dict(_histograms)
+    metrics = {}
+    for stage, histogram in sorted(histograms.items()):
+        _, total, count = histogram.snapshot()
+        metrics[stage] = {"count": count, "sum_s": total, "p50_s": histogram.quantile(0.50),
+                          "p95_s": histogram.quantile(0.95)}
+    return metrics
+
+
+# Counters and latency summaries the other modules keep, as one dict by component; only modules the
+# app has already imported are asked, so this never loads the model or opens a cache
+def component_metrics():
+    import sys
+
+    metrics = {}
+    sources = {
+        "inference": ('inference_server', 'server_stats'),
+        "regions": ('face_regions', 'region_metrics'),
+        "llm": ('llm_client', 'llm_metrics'),
+        "llm_cache": ('llm_cache', 'cache_stats'),
+        "models": ('model_registry', 'model_metrics'),
+        "warmup": ('warmup', 'status'),
+    }
+    for component, (module_name, function) in sources.items():
+        module = sys.modules.get(module_name)
+        if module is not None:
+            metrics[component] = getattr(module, function)()
+    return metrics
+
+
+# Keys whose dicts are keyed by a value (a model file, a pid, ...) rather than by metric names
+_LABELS = {"inference": "model", "models": "model", "versions": "version", "worker_rss_anon_mb": "pid",
+           "worker_rss_file_mb": "pid", "top1_share": "class", "steps": "step"}
+
+
+_NON_WORD = re.compile(r'\W')
+
+
+# Numeric leaves of nested metrics as {metric name: [(labels, value)]}; strings and None are skipped.
+# `key` is the key `value` was found under, which says whether its own keys are names or labels.
+def _flatten(name, key, value, labels, samples):
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, float)):
+        samples.setdefault(name, []).append((labels, value))
+    elif isinstance(value, dict):
+        label = _LABELS.get(key)
+        for k, item in value.items():
+            if label is not None:
+                escaped = str(k).replace('\\', '\\\\').replace('"', '\\"')
+                _flatten(name, k, item, labels + (f'{label}="{escaped}"',), samples)
+            else:
+                _flatten(name + '_' + _NON_WORD.sub('_', str(k)), k, item, labels, samples)
+
+
+def _label(bound):
+    return '+Inf' if bound == float('inf') else f"{bound:g}"
+
+
+# Stage histograms and process memory in the Prometheus text exposition format
+def render_prometheus():
+    with _histograms_lock:
+        histograms = dict(_histograms)
+    lines = ["# HELP sfie_stage_seconds Time spent per app stage.", "# TYPE sfie_stage_seconds histogram"]
+    for stage, histogram in sorted(histograms.items()):
+        counts, total, count = histogram.snapshot()
+        cumulative = 0
+        for bound, n in zip(histogram.buckets, counts):
+            cumulative += n
+            lines.append(f'sfie_stage_seconds_bucket{{stage="{stage}",le="{_label(bound)}"}} {cumulative}')
+        lines.append(f'sfie_stage_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(f'sfie_stage_seconds_count{{stage="{stage}"}} {count}')
+    rss = rss_mb()
+    if rss is not None:
+        lines += ["# HELP sfie_resident_memory_bytes Resident set size of the app process.",
+                  "# TYPE sfie_resident_memory_bytes gauge",
+                  f"sfie_resident_memory_bytes {int(rss * 2 ** 20)}"]
+    # Inference queue and cache, cascade tiers, worker pool, face regions, LLM TTFT and cache, model loads
+    samples = {}
+    for component, metrics in component_metrics().items():
+        _flatten(f"sfie_{component}", component, metrics, (), samples)
+    for name, values in sorted(samples.items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines += [f"{name}{{{','.join(labels)}}} {value}" if labels else f"{name} {value}" for labels, value in values]
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        data = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _log_forever(interval):
+    while True:
+        time.sleep(interval)
+        parts = [f"{stage} n={m['count']} p50<={m['p50_s']:g}s p95<={m['p95_s']:g}s"
+                 for stage, m in stage_metrics().items() if m['count']]
+        rss = rss_mb()
+        logger.info("stage latency: %s; rss %s MB", ', '.join(parts) or 'no spans',
+                    f"{rss:.0f}" if rss is not None else "n/a")
+
+
+# Start the metrics endpoint and the log thread once per process (the script itself reruns constantly)
+def start(port=METRICS_PORT, log_interval=LOG_INTERVAL):
+    global _started
+    if not ENABLED or _started:
+        return
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+        if port:
+            try:
+                server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+            except OSError as e:
+                logger.warning("Metrics endpoint on port %s unavailable (%s)", port, e)
+            else:
+                server.daemon_threads = True
+                threading.Thread(target=server.serve_forever, name='sfie-metrics', daemon=True).start()
+        if log_interval:
+            threading.Thread(target=_log_forever, args=(log_interval,), name='sfie-telemetry-log',
+                             daemon=True).start()
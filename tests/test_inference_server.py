@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from inference_server import InferenceServer, ServerBusy
+from prediction_cache import PredictionCache
+
+
+# Backend answering every photo with its width; `gate`, when given, holds each batch until set
+class FakeBackend:
+    name = 'fake'
+
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.batches = []
+        self.started = threading.Event()
+
+    def version(self):
+        return 'fake:1'
+
+    def predict_batch(self, imgs):
+        self.batches.append(len(imgs))
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        return [{'width': float(img.size[0])} for img in imgs]
+
+
+def image(width):
+    return Image.new('RGB', (width, 8))
+
+
+def test_requests_are_batched():
+    backend = FakeBackend()
+    server = InferenceServer(backend=backend, batch_window_ms=500, max_batch=4)
+    futures = [server.submit(image(w)) for w in range(1, 9)]
+    assert [f.result(5) for f in futures] == [{'width': float(w)} for w in range(1, 9)]
+    assert backend.batches == [4, 4]
+    assert server.stats()['mean_batch_size'] == 4
+
+
+def test_full_queue_raises_server_busy():
+    gate = threading.Event()
+    backend = FakeBackend(gate)
+    server = InferenceServer(backend=backend, batch_window_ms=0, max_batch=1, max_queue=2, submit_timeout=0.05)
+    running = server.submit(image(1))
+    assert backend.started.wait(5)
+    queued = [server.submit(image(2)), server.submit(image(3))]
+    with pytest.raises(ServerBusy):
+        server.submit(image(4))
+    assert server.stats()['rejected'] == 1
+
+    gate.set()
+    assert running.result(5) == {'width': 1.0}
+    assert [f.result(5) for f in queued] == [{'width': 2.0}, {'width': 3.0}]
+
+
+def test_backend_errors_reach_every_caller():
+    class FailingBackend(FakeBackend):
+        def predict_batch(self, imgs):
+            raise RuntimeError("model failed")
+
+    server = InferenceServer(backend=FailingBackend(), batch_window_ms=100, max_batch=4)
+    futures = [server.submit(image(w)) for w in range(1, 4)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model failed"):
+            future.result(5)
+
+
+def test_cache_hits_skip_the_backend():
+    backend = FakeBackend()
+    server = InferenceServer(backend=backend, batch_window_ms=0, cache=PredictionCache(max_entries=16))
+    assert server.predict_many([image(5)], timeout=5) == [{'width': 5.0}]
+    assert server.predict_many([image(5)], timeout=5) == [{'width': 5.0}]
+    assert backend.batches == [1]
+
+    # Warm-up bypasses the cache
+    server.predict_many([image(5)], timeout=5, use_cache=False)
+    assert backend.batches == [1, 1]
+
+
+def test_one_dispatch_thread_per_concurrent_batch():
+    gate = threading.Event()
+    backend = FakeBackend(gate)
+    backend.concurrency = 2
+    server = InferenceServer(backend=backend, batch_window_ms=0, max_batch=1)
+    futures = [server.submit(image(1)), server.submit(image(2))]
+    # Both batches are inside the backend at once, each on its own thread
+    deadline = time.monotonic() + 5
+    while len(backend.batches) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert backend.batches == [1, 1]
+    gate.set()
+    assert [f.result(5) for f in futures] == [{'width': 1.0}, {'width': 2.0}]
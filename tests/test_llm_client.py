@@ -0,0 +1,45 @@
+import httpx
+import pytest
+
+import llm_client
+from llm_client import LLMError, iter_completion, stream_response
+
+
+# Route the shared client to a server that streams `body` back
+@pytest.fixture
+def sse(monkeypatch):
+    def serve(body):
+        transport = httpx.MockTransport(lambda request: httpx.Response(
+            200, content=body.encode(), headers={'Content-Type': 'text/event-stream'}))
+        monkeypatch.setattr(llm_client, 'get_client', lambda: httpx.Client(transport=transport))
+    return serve
+
+
+def event(delta):
+    return f'data: {{"choices": [{{"delta": {{"content": "{delta}"}}}}]}}\n\n'
+
+
+def test_tokens_are_streamed(sse):
+    sse(': keep-alive\n\n' + event('Hello') + event(' there') + 'data: [DONE]\n\n')
+    assert list(iter_completion("prompt", "key", "http://llm.test")) == ['Hello', ' there']
+
+
+def test_malformed_event_raises_llm_error(sse):
+    sse(event('Hello') + 'data: {"choices": [\n\n')
+    tokens = iter_completion("prompt", "key", "http://llm.test")
+    assert next(tokens) == 'Hello'
+    with pytest.raises(LLMError, match="malformed event"):
+        next(tokens)
+
+
+def test_error_event_raises_llm_error(sse):
+    sse(event('Hel') + 'data: {"error": {"message": "model overloaded", "type": "server_error"}}\n\n')
+    with pytest.raises(LLMError, match="The request failed: model overloaded"):
+        list(iter_completion("prompt", "key", "http://llm.test"))
+
+
+def test_stream_response_shows_the_error_as_text(sse):
+    sse(event('Hel') + 'data: not json\n\n')
+    tokens = list(stream_response("prompt", "key", "http://llm.test"))
+    assert tokens[0] == 'Hel'
+    assert tokens[-1].startswith("The request failed: malformed event")
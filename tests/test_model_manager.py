@@ -0,0 +1,184 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import model_manager
+from backends import with_cascade
+from model_manager import ModelManager
+
+
+# Backend whose one class is the artifact's contents; `gate`, when given, holds each batch until set
+class FakeBackend:
+    name = 'fake'
+
+    def __init__(self, path, gate=None):
+        with open(path) as f:
+            self.label = f.read()
+        self.path = path
+        self.gate = gate
+        self.started = threading.Event()
+        self.closed = False
+
+    def version(self):
+        return self.label
+
+    def vocab(self):
+        return [self.label]
+
+    def predict_batch(self, imgs):
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        return [{self.label: 1.0} for _ in imgs]
+
+    def close(self):
+        self.closed = True
+
+    # The same artifact at a reduced input size, as the worker pool offers it for the cascade's fast tier
+    def scaled(self, size):
+        fast = FakeBackend(self.path)
+        fast.label = f'{self.label}@{size}'
+        fast.name = f'fake@{size}'
+        self.fast = fast
+        return fast
+
+
+class Factory:
+    def __init__(self):
+        self.backends = []
+        self.gate = None
+
+    def __call__(self, path, backend_name):
+        backend = FakeBackend(path, self.gate)
+        if backend.label == 'broken':
+            raise RuntimeError("cannot load")
+        self.backends.append(backend)
+        return backend
+
+
+# Write an artifact old enough for the manager to consider it settled
+def write_artifact(path, contents, age=10):
+    with open(path, 'w') as f:
+        f.write(contents)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def factory():
+    return Factory()
+
+
+def manager(tmp_path, factory, **kwargs):
+    kwargs.setdefault('model_path', str(tmp_path / 'export.pkl'))
+    kwargs.setdefault('make_version_backend', factory)
+    return ModelManager(backend_name='fake', poll_seconds=0, store_dir=str(tmp_path / 'store'), **kwargs)
+
+
+def test_new_artifact_replaces_the_active_one(tmp_path, factory):
+    models = tmp_path / 'models'
+    models.mkdir()
+    write_artifact(models / 'v1.pkl', 'v1', age=20)
+    m = manager(tmp_path, factory, model_dir=str(models))
+    assert m.predict_batch(['img']) == [{'v1': 1.0}]
+    old = factory.backends[0]
+
+    write_artifact(models / 'v2.pkl', 'v2')
+    m.reload()
+    assert m.predict_batch(['img']) == [{'v2': 1.0}]
+    assert m.swaps == 1
+    # Nothing was in flight, so v1 is unloaded at once, snapshot included
+    assert old.closed
+    assert not os.path.exists(old.path)
+
+
+def test_batch_in_flight_finishes_on_its_version(tmp_path, factory):
+    write_artifact(tmp_path / 'export.pkl', 'v1')
+    gate = factory.gate = threading.Event()
+    m = manager(tmp_path, factory)
+    old = factory.backends[0]
+
+    results = []
+    worker = threading.Thread(target=lambda: results.extend(m.predict_batch(['img'])))
+    worker.start()
+    assert old.started.wait(5)
+
+    factory.gate = None
+    write_artifact(tmp_path / 'export.pkl', 'v2')
+    m.reload()
+    assert m.predict_batch(['img']) == [{'v2': 1.0}]
+    # v1 is retired but still serving the batch that started on it
+    assert not old.closed
+
+    gate.set()
+    worker.join(5)
+    assert results == [{'v1': 1.0}]
+    assert old.closed
+
+
+def test_failed_load_keeps_the_current_version(tmp_path, factory):
+    write_artifact(tmp_path / 'export.pkl', 'v1')
+    m = manager(tmp_path, factory)
+    write_artifact(tmp_path / 'export.pkl', 'broken')
+    m.reload()
+    assert m.predict_batch(['img']) == [{'v1': 1.0}]
+    assert m.swaps == 0
+
+
+def test_touched_artifact_is_not_reloaded(tmp_path, factory):
+    write_artifact(tmp_path / 'export.pkl', 'v1', age=20)
+    m = manager(tmp_path, factory)
+    write_artifact(tmp_path / 'export.pkl', 'v1')
+    m.reload()
+    assert m.swaps == 0
+    assert len(factory.backends) == 1
+
+
+def test_candidate_gets_its_share(tmp_path, factory):
+    write_artifact(tmp_path / 'export.pkl', 'active')
+    write_artifact(tmp_path / 'candidate.pkl', 'candidate')
+    m = manager(tmp_path, factory, candidate=str(tmp_path / 'candidate.pkl'), candidate_percent=100)
+    assert m.predict_batch(['a', 'b']) == [{'candidate': 1.0}] * 2
+    assert m.version().endswith(':100')
+
+    m.candidate_percent = 0
+    assert m.predict_batch(['a', 'b']) == [{'active': 1.0}] * 2
+
+    # Removing the candidate file retires it
+    os.remove(tmp_path / 'candidate.pkl')
+    candidate = factory.backends[1]
+    m.reload()
+    assert m.stats()['candidate'] is None
+    assert candidate.closed
+
+
+def test_cascade_fast_tier_follows_the_active_version(tmp_path, factory):
+    write_artifact(tmp_path / 'export.pkl', 'v1')
+    m = manager(tmp_path, factory,
+                make_version_backend=lambda path, name: with_cascade(factory(path, name), 'direct', path))
+    (result,) = m.predict_batch(['img'])
+    assert result.tier == 'fast' and list(result) == ['v1@160']
+    old = factory.backends[0]
+
+    write_artifact(tmp_path / 'export.pkl', 'v2')
+    m.reload()
+    (result,) = m.predict_batch(['img'])
+    assert result.tier == 'fast' and list(result) == ['v2@160']
+    # Unloading the old version closes both of its tiers
+    assert old.closed and old.fast.closed
+
+
+def test_store_of_exited_processes_is_removed(tmp_path):
+    store = tmp_path / 'store'
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    (store / str(exited.pid)).mkdir(parents=True)
+    (store / str(exited.pid) / 'export-old.pkl').write_text('old')
+
+    own = model_manager._process_store(str(store))
+    assert os.path.isdir(own)
+    assert not (store / str(exited.pid)).exists()
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+from PIL import Image
+
+import warmup
+from inference_server import InferenceServer, ServerBusy
+
+
+# Backend taking a while per batch, serving as many batches at once as a pool of 8 workers
+class SlowBackend:
+    name = 'slow'
+    concurrency = 8
+
+    def __init__(self):
+        self.photos = 0
+
+    def version(self):
+        return 'slow:1'
+
+    def predict_batch(self, imgs):
+        time.sleep(0.02)
+        self.photos += len(imgs)
+        return [{'a': 1.0} for _ in imgs]
+
+
+@pytest.fixture
+def status(monkeypatch):
+    monkeypatch.setattr(warmup, '_status', {"ready": False, "state": "not started", "error": None,
+                                            "started_at": None, "seconds": None, "steps": {}})
+
+
+def test_warm_server_stays_within_the_queue():
+    backend = SlowBackend()
+    # 8 threads sending 4 photos each would be 32 requests for a queue of 8
+    server = InferenceServer(backend=backend, batch_window_ms=0, max_batch=4, max_queue=8, submit_timeout=0.01)
+    imgs = [Image.new('RGB', (8, 8))]
+    warmup.warm_server(server, imgs, [1, 4], rounds=2)
+    assert backend.photos == 2 * 8 * (1 + 4)
+    assert server.stats()['rejected'] == 0
+
+
+def test_run_retries_a_transient_failure(monkeypatch, status):
+    attempts = []
+
+    def warm(model_path, catalog_path, rounds):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ServerBusy("Inference queue is full")
+
+    monkeypatch.setattr(warmup, '_warm', warm)
+    assert warmup.run(retries=2, backoff=0)
+    assert len(attempts) == 2
+    assert warmup.status()['state'] == 'ready' and warmup.is_ready()
+
+
+def test_run_fails_once_retries_are_spent(monkeypatch, status):
+    def warm(model_path, catalog_path, rounds):
+        raise FileNotFoundError("export.pkl")
+
+    monkeypatch.setattr(warmup, '_warm', warm)
+    assert not warmup.run(retries=2, backoff=0)
+    assert warmup.status()['state'] == 'failed' and not warmup.is_ready()
+    assert 'FileNotFoundError' in warmup.status()['error']
@@ -0,0 +1,174 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Warm-up settings, overridable from the environment
+ENABLED = os.environ.get('SFIE_WARMUP', '1') == '1'
+# Readiness endpoint (GET /ready: 200 once warm, 503 before) on this port; 0 disables it
+READY_PORT = int(os.environ.get('SFIE_READY_PORT', 0))
+# Passes over every batch size; the first pays for lazy init, the rest settle kernel selection
+ROUNDS = int(os.environ.get('SFIE_WARMUP_ROUNDS', 2))
+# Attempts after a failed warm-up (a busy queue, a model file still being deployed), BACKOFF seconds
+# apart and doubling; only then does the process report failed
+RETRIES = int(os.environ.get('SFIE_WARMUP_RETRIES', 3))
+BACKOFF = float(os.environ.get('SFIE_WARMUP_BACKOFF', 2))
+
+_status = {"ready": False, "state": "not started", "error": None, "started_at": None, "seconds": None,
+           "steps": {}}
+_status_lock = threading.Lock()
+_started = False
+_start_lock = threading.Lock()
+
+
+def is_ready():
+    return _status["ready"]
+
+
+def status():
+    with _status_lock:
+        return dict(_status, steps=dict(_status["steps"]))
+
+
+def _set(**fields):
+    with _status_lock:
+        _status.update(fields)
+
+
+def _step(name, fn):
+    start = time.perf_counter()
+    result = fn()
+    with _status_lock:
+        _status["steps"][name] = time.perf_counter() - start
+    return result
+
+
+def sample_images():
+    from ingest import ingest_upload
+
+    imgs = []
+    for path in sorted(glob.glob(os.path.join(ROOT, '*.jpg'))):
+        with open(path, 'rb') as f:
+            imgs.append(ingest_upload(f).model_image)
+    return imgs
+
+
+# predict_many() of the inference server with its cache bypassed, so every round runs the model. Photos
+# go in chunks of a full batch, and the warm-up threads together never have more than the server's
+# queue holds, so warming in parallel can't make the server turn requests away as busy.
+class _Uncached:
+    def __init__(self, server):
+        self.server = server
+        self._chunks = threading.Semaphore(max(1, server.max_queue // server.max_batch))
+
+    def predict_many(self, imgs):
+        results = []
+        for i in range(0, len(imgs), self.server.max_batch):
+            with self._chunks:
+                results.extend(self.server.predict_many(imgs[i:i + self.server.max_batch], use_cache=False))
+        return results
+
+
+# Run the analyzer's shapes through the inference server, past the prediction cache (which would
+# answer every round after the first): one photo as predict() sends it, the sample set as "Analyze
+# all" does, and a full batch. Going through the server's queue means the model is only ever used
+# from the server's own worker thread(s), never alongside a user's batch. Backends serving several
+# batches at once (the process pool) get that many in parallel so every worker is warmed.
+def warm_server(server, imgs, batch_sizes, rounds=ROUNDS):
+    from face_regions import predict_regions_many
+
+    predictor = _Uncached(server)
+    concurrency = getattr(server.backend, 'concurrency', 1)
+    with ThreadPoolExecutor(concurrency) as executor:
+        for _ in range(rounds):
+            for size in batch_sizes:
+                batch = [imgs[i % len(imgs)] for i in range(size)]
+                list(executor.map(lambda _: predict_regions_many(predictor, batch), range(concurrency)))
+
+
+def _warm(model_path, catalog_path, rounds):
+    from catalog import get_catalog
+    from inference_server import get_server
+
+    _step("catalog", lambda: get_catalog(catalog_path))
+    # The same process-wide server and cached model app.py's predict() uses
+    server = get_server(model_path)
+    _step("model_load", server.backend.version)
+    imgs = _step("decode", sample_images)
+    if imgs:
+        sizes = sorted({1, len(imgs), server.max_batch})
+        _step("predict", lambda: warm_server(server, imgs, sizes, rounds))
+
+
+# Load the model and the catalog and run dummy batches, so the first real user gets steady-state latency
+def run(model_path='export.pkl', catalog_path='recommendation.xlsx', rounds=ROUNDS, retries=RETRIES,
+        backoff=BACKOFF):
+    _set(state="warming", started_at=time.time())
+    start = time.perf_counter()
+    for attempt in range(retries + 1):
+        try:
+            _warm(model_path, catalog_path, rounds)
+            break
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if attempt == retries:
+                logger.exception("Warm-up failed")
+                _set(state="failed", error=error, seconds=time.perf_counter() - start)
+                return False
+            delay = backoff * 2 ** attempt
+            logger.warning("Warm-up failed (%s), retrying in %.0fs", error, delay)
+            _set(state="retrying", error=error)
+            time.sleep(delay)
+    seconds = time.perf_counter() - start
+    _set(ready=True, state="ready", error=None, seconds=seconds)
+    logger.info("Warm-up finished in %.2fs (%s)", seconds,
+                ', '.join(f"{name} {s:.2f}s" for name, s in status()["steps"].items()))
+    return True
+
+
+class _ReadyHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0].rstrip('/') != '/ready':
+            self.send_error(404)
+            return
+        data = json.dumps(status()).encode('utf-8')
+        self.send_response(200 if is_ready() else 503)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+# Start the readiness endpoint and the warm-up thread once per process; the app keeps serving meanwhile.
+# With warm-up disabled the process reports ready straight away.
+def start(port=READY_PORT, enabled=ENABLED):
+    global _started
+    if _started:
+        return
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+        if port:
+            try:
+                server = ThreadingHTTPServer(('0.0.0.0', port), _ReadyHandler)
+            except OSError as e:
+                logger.warning("Readiness endpoint on port %s unavailable (%s)", port, e)
+            else:
+                server.daemon_threads = True
+                threading.Thread(target=server.serve_forever, name='sfie-ready', daemon=True).start()
+        if enabled:
+            threading.Thread(target=run, name='sfie-warmup', daemon=True).start()
+        else:
+            _set(ready=True, state="disabled")